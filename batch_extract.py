@@ -0,0 +1,212 @@
+"""Extract marksheets in bulk from the command line.
+
+Walks directories (or reads a list of paths), runs the documents through
+MarksheetPipeline on a pool of worker processes and streams one row per
+document to a CSV or JSONL file as soon as it finishes. Every finished path is
+also appended to a checkpoint file, so an interrupted run continues where it
+stopped with --resume.
+
+Each worker process runs its own pipeline with OCR_WORKERS threads (by
+default the cores divided by the number of processes), so the OCR attempts of
+all documents together keep every core busy without oversubscribing it.
+
+Usage: python batch_extract.py scans/ [more dirs or files] -o results.csv [--workers 8] [--resume]
+       python batch_extract.py --file-list paths.txt -o results.jsonl
+"""
+import argparse
+import csv
+import json
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, FIRST_COMPLETED, wait
+
+EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf'}
+
+CSV_FIELDS = ['file', 'success', 'marksheet_type', 'spi', 'cpi', 'percentage_10th', 'percentage_12th',
+              'pages', 'ocr_attempts', 'cache', 'seconds', 'error']
+
+# Set in each worker process by _init_worker
+_pipeline = None
+
+
+def _init_worker(config, ocr_threads):
+    global _pipeline
+    # The pipeline module sizes its pools from the environment when imported
+    os.environ.setdefault('OCR_WORKERS', str(ocr_threads))
+    os.environ.setdefault('BATCH_WORKERS', '1')
+    # Tesseract's own OpenMP threads would compete with the other processes
+    os.environ.setdefault('OMP_THREAD_LIMIT', '1')
+    from pipeline import MarksheetPipeline
+    _pipeline = MarksheetPipeline(config)
+
+
+def extract_file(path, dpi=None, max_pages=None):
+    """Run one document through the worker's pipeline; failures become results"""
+    from pipeline import to_api_result
+    start = time.perf_counter()
+    try:
+        with open(path, 'rb') as f:
+            result = to_api_result(_pipeline.run(f.read(), os.path.basename(path), dpi, max_pages))
+    except Exception as e:
+        result = {'success': False, 'error': str(e)}
+    result['seconds'] = round(time.perf_counter() - start, 3)
+    return result
+
+
+def iter_paths(inputs, file_list=None):
+    """Yield every marksheet file under the given files/directories, then those in file_list"""
+    for path in inputs:
+        if os.path.isdir(path):
+            for root, dirs, files in os.walk(path):
+                dirs.sort()
+                for name in sorted(files):
+                    if name.rsplit('.', 1)[-1].lower() in EXTENSIONS:
+                        yield os.path.join(root, name)
+        else:
+            yield path
+
+    if file_list:
+        with (sys.stdin if file_list == '-' else open(file_list, encoding='utf-8')) as f:
+            for line in f:
+                if line.strip():
+                    yield line.strip()
+
+
+def read_checkpoint(path, retry_failed=False):
+    """Paths already finished by a previous run ('path<TAB>ok|failed' per line)"""
+    done = set()
+    if not os.path.exists(path):
+        return done
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            file_path, _, status = line.rstrip('\n').rpartition('\t')
+            if file_path and (status == 'ok' or not retry_failed):
+                done.add(file_path)
+    return done
+
+
+class ResultWriter:
+    """Append results to a CSV or JSONL file, flushing after every row"""
+
+    def __init__(self, path, output_format, append=False):
+        self.format = output_format
+        write_header = not (append and os.path.exists(path) and os.path.getsize(path) > 0)
+        self.file = open(path, 'a' if append else 'w', encoding='utf-8', newline='')
+        if self.format == 'csv':
+            self.writer = csv.DictWriter(self.file, fieldnames=CSV_FIELDS, extrasaction='ignore')
+            if write_header:
+                self.writer.writeheader()
+
+    def write(self, path, result):
+        row = {'file': path, **result}
+        if self.format == 'csv':
+            if 'pages' in row:
+                row['pages'] = len(row['pages'])
+            self.writer.writerow(row)
+        else:
+            self.file.write(json.dumps(row) + '\n')
+        self.file.flush()
+
+    def close(self):
+        self.file.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Extract SPI/CPI or percentages from folders of marksheets')
+    parser.add_argument('inputs', nargs='*', help='marksheet files and/or directories (searched recursively)')
+    parser.add_argument('--file-list', help="file with one document path per line ('-' for stdin)")
+    parser.add_argument('-o', '--output', required=True, help='results file (.csv or .jsonl)')
+    parser.add_argument('--format', choices=['csv', 'jsonl'], help='output format (default: from the output extension)')
+    parser.add_argument('--checkpoint', help='finished paths are recorded here (default: OUTPUT.checkpoint)')
+    parser.add_argument('--resume', action='store_true', help='skip documents in the checkpoint and append to the output')
+    parser.add_argument('--retry-failed', action='store_true', help='with --resume, process failed documents again')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='worker processes (default: cores)')
+    parser.add_argument('--ocr-threads', type=int, help='OCR threads per worker (default: cores / workers)')
+    parser.add_argument('--mode', choices=['parallel', 'cascade'], help='OCR mode (default: OCR_MODE)')
+    parser.add_argument('--no-roi', action='store_true', help='OCR whole pages instead of the result region')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the result cache')
+    parser.add_argument('--dpi', type=int, help='PDF render resolution')
+    parser.add_argument('--max-pages', type=int, help='maximum PDF pages per document')
+    parser.add_argument('--progress', type=float, default=10, help='seconds between progress lines (0 to disable)')
+    args = parser.parse_args()
+
+    if not args.inputs and not args.file_list:
+        parser.error('give at least one file or directory, or --file-list')
+    output_format = args.format or ('jsonl' if args.output.lower().endswith(('.jsonl', '.json')) else 'csv')
+    checkpoint_path = args.checkpoint or args.output + '.checkpoint'
+
+    done = read_checkpoint(checkpoint_path, args.retry_failed) if args.resume else set()
+    config = {'cache': {'enabled': not args.no_cache}}
+    if args.mode:
+        config['ocr'] = {'mode': args.mode}
+    if args.no_roi:
+        config['locate'] = {'enabled': False}
+    ocr_threads = args.ocr_threads or max(1, (os.cpu_count() or 1) // args.workers)
+
+    writer = ResultWriter(args.output, output_format, append=args.resume)
+    checkpoint = open(checkpoint_path, 'a' if args.resume else 'w', encoding='utf-8')
+    processed = failed = skipped = 0
+    start = last_progress = time.perf_counter()
+
+    def report(final=False):
+        elapsed = time.perf_counter() - start
+        rate = processed / elapsed if elapsed else 0.0
+        print(f'{"Done" if final else "Progress"}: {processed} documents in {elapsed:.1f}s '
+              f'({rate:.2f} docs/sec), {failed} failed, {skipped} skipped', file=sys.stderr)
+
+    # Keep a bounded number of documents queued so huge folders aren't
+    # submitted (and their results held) all at once
+    max_pending = args.workers * 4
+    pending = {}
+
+    def collect(futures):
+        nonlocal processed, failed
+        for future in futures:
+            path = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                # The worker process itself died
+                result = {'success': False, 'error': str(e)}
+            writer.write(path, result)
+            checkpoint.write(f'{path}\t{"ok" if result.get("success") else "failed"}\n')
+            checkpoint.flush()
+            processed += 1
+            failed += not result.get('success')
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=_init_worker,
+                                 initargs=(config, ocr_threads)) as executor:
+            for path in iter_paths(args.inputs, args.file_list):
+                if path in done:
+                    skipped += 1
+                    continue
+                pending[executor.submit(extract_file, path, args.dpi, args.max_pages)] = path
+
+                if len(pending) >= max_pending:
+                    finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+                    collect(finished)
+                if args.progress and time.perf_counter() - last_progress >= args.progress:
+                    report()
+                    last_progress = time.perf_counter()
+
+            while pending:
+                finished, _ = wait(pending, timeout=args.progress or None, return_when=FIRST_COMPLETED)
+                collect(finished)
+                if args.progress and time.perf_counter() - last_progress >= args.progress:
+                    report()
+                    last_progress = time.perf_counter()
+    except KeyboardInterrupt:
+        print(f'Interrupted; rerun with --resume to continue from {checkpoint_path}', file=sys.stderr)
+        raise
+    finally:
+        writer.close()
+        checkpoint.close()
+
+    report(final=True)
+    return 1 if failed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
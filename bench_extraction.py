@@ -0,0 +1,76 @@
+"""Micro-benchmark for the text extractors on large OCR dumps.
+
+Builds synthetic OCR output by joining marksheet-like attempt texts with the
+attempt separator used by app.py, then times detection plus extraction at
+growing sizes. Time per KB should stay flat as the dump grows.
+
+Usage: python bench_extraction.py [--sizes 10,100,1000] [--repeat 5]
+"""
+import argparse
+import random
+import time
+
+from extraction import detect_marksheet_type, extract_college_marksheet_data, extract_school_marksheet_data
+
+ATTEMPT_SEPARATOR = '\n\n--- OCR ATTEMPT ---\n\n'
+
+COLLEGE_ATTEMPT = (
+    'SARVAJANIK UNIVERSITY\nStatement of Grades Semester {semester}\n'
+    'Course Code Course Name Credits Grade Points\n{courses}\n'
+    'Semester Performance Credits Grade Points SPI {spi}\n'
+    'Cumulative Performance Credits Grade Points CPI {cpi}\n'
+)
+SCHOOL_ATTEMPT = (
+    'CENTRAL BOARD OF SECONDARY EDUCATION\nSecondary School Examination\n'
+    '{subjects}\nTotal {total} Percentage: {percentage}%\nResult PASS\n'
+)
+
+
+def make_attempt(rng, kind):
+    if kind == 'college':
+        courses = '\n'.join(f'CS{rng.randint(100, 999)} Subject {i} {rng.randint(1, 5)} {rng.choice("ABC")} '
+                            f'{rng.randint(4, 10)}' for i in range(8))
+        return COLLEGE_ATTEMPT.format(semester=rng.randint(1, 8), courses=courses,
+                                      spi=f'{rng.uniform(5, 10):.2f}', cpi=f'{rng.uniform(5, 10):.2f}')
+    subjects = '\n'.join(f'Subject {i} {rng.randint(40, 100)}' for i in range(6))
+    return SCHOOL_ATTEMPT.format(subjects=subjects, total=rng.randint(300, 500),
+                                 percentage=f'{rng.uniform(40, 100):.2f}')
+
+
+def make_dump(rng, kind, size_kb):
+    attempts = []
+    length = 0
+    while length < size_kb * 1024:
+        attempts.append(make_attempt(rng, kind))
+        length += len(attempts[-1]) + len(ATTEMPT_SEPARATOR)
+    return ATTEMPT_SEPARATOR.join(attempts)
+
+
+def extract(text):
+    if detect_marksheet_type(text) == 'college':
+        return extract_college_marksheet_data(text)
+    return extract_school_marksheet_data(text)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark marksheet text extraction')
+    parser.add_argument('--sizes', default='1,10,100,1000', help='comma-separated dump sizes in KB')
+    parser.add_argument('--repeat', type=int, default=5, help='timed runs per size (best is reported)')
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    print(f"{'kind':<8} {'size KB':>8} {'best ms':>10} {'us/KB':>8}")
+    for kind in ('college', 'school'):
+        for size_kb in (int(size) for size in args.sizes.split(',')):
+            text = make_dump(rng, kind, size_kb)
+            timings = []
+            for _ in range(args.repeat):
+                start = time.perf_counter()
+                extract(text)
+                timings.append(time.perf_counter() - start)
+            best = min(timings)
+            print(f'{kind:<8} {len(text) / 1024:>8.0f} {best * 1000:>10.2f} {best * 1e6 / (len(text) / 1024):>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
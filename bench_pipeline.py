@@ -0,0 +1,304 @@
+"""End-to-end benchmark of the extraction pipeline on synthetic marksheets.
+
+Generates a reproducible corpus with generate_sample_marksheet.py (known SPI
+and CPI, varied resolution, noise, skew, JPEG quality, some documents as
+PDFs), runs it through MarksheetPipeline in several modes and reports latency
+percentiles, throughput, peak memory and field accuracy against the ground
+truth. Every mode runs in a fresh process, so peak RSS and warm-up are per
+mode, and the time to import the pipeline there (cold start) and the latency
+of the first document are reported; with --warm-up the pipeline is warmed up
+first, as a worker started with WARMUP_ON_BOOT=1 would be. The result cache is
+always bypassed.
+
+With --samples the scans shipped in the repository (with their known values)
+are benchmarked instead.
+
+Usage: python bench_pipeline.py [--count 24] [--modes parallel,cascade] [--warm-up] [--output bench.json] [--compare old.json]
+       python bench_pipeline.py --samples --modes parallel,denoise_none,denoise_median,denoise_bilateral,denoise_nlmeans
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import random
+import subprocess
+import time
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from PIL import Image
+
+from generate_sample_marksheet import generate_sample_marksheet
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then not reported
+    resource = None
+
+CORPUS_VERSION = 1
+
+# MarksheetPipeline stage config per benchmark mode
+MODES = {
+    # Every attempt at once, cancelled once the attempts agree (the default)
+    'parallel': {},
+    # Every attempt at once, always all of them
+    'parallel_full': {'vote': {'agreement_min_votes': 1000}},
+    # One attempt at a time, all of them
+    'serial': {'ocr': {'mode': 'cascade', 'cascade_batch': 1, 'stop_policy': 'never'}},
+    # One attempt at a time, stopping once the fields are found
+    'cascade': {'ocr': {'mode': 'cascade', 'cascade_batch': 1}},
+    # A small variant set
+    'fast_variants': {'ocr': {'attempts': ['original_gray', 'enhanced_psm6', 'scaled_enhanced']}},
+    # Whole pages instead of the result region
+    'no_roi': {'locate': {'enabled': False}},
+    # Generic pipeline for every page, ignoring the known layouts
+    'no_layouts': {'layout': {'enabled': False}},
+    # Full OCR attempts even when the value cells read confidently
+    'no_numeric': {'numeric': {'enabled': False}},
+    # Every attempt on every page, voting on the type afterwards
+    'no_classify': {'classify': {'enabled': False}},
+    # Pages as uploaded, without deskew or orientation correction
+    'no_geometry': {'geometry': {'deskew': False, 'orientation': 'never'}},
+    # Input resolution instead of the normalized text height
+    'no_normalize': {'preprocess': {'text_height': 0}},
+    # One denoising strategy for every page instead of choosing by noise level
+    'denoise_none': {'preprocess': {'denoise': 'none'}},
+    'denoise_median': {'preprocess': {'denoise': 'median'}},
+    'denoise_bilateral': {'preprocess': {'denoise': 'bilateral'}},
+    'denoise_nlmeans': {'preprocess': {'denoise': 'nlmeans'}},
+}
+
+# Ground truth of the sample scans in the repository (--samples); None is a blank field
+SAMPLES = [
+    {'file': 'sem1.jpg', 'spi': '8.81', 'cpi': None},
+    {'file': 'sem2.jpg', 'spi': '8.86', 'cpi': '8.83'},
+    {'file': 'sem3.jpg', 'spi': '8.70', 'cpi': '8.78'},
+    {'file': 'sem4.jpg', 'spi': '8.18', 'cpi': '8.63'},
+    {'file': 'divij.jpg', 'spi': '7.82', 'cpi': '7.98'},
+    {'file': 'krish2.jpg', 'spi': '7.81', 'cpi': '8.45'},
+]
+
+
+def generate_corpus(directory, count, seed=0, scales=(0.6, 1.0, 1.5), noise=(0, 8, 20), skew=(0, 1.5, -3),
+                    jpeg_quality=(95, 60, 30), pdf_every=4):
+    """Write `count` marksheets to `directory` and return their manifest entries.
+
+    The same arguments always produce the same files, and an existing corpus
+    with a matching manifest is reused.
+    """
+    params = {'version': CORPUS_VERSION, 'count': count, 'seed': seed, 'scales': list(scales),
+              'noise': list(noise), 'skew': list(skew), 'jpeg_quality': list(jpeg_quality), 'pdf_every': pdf_every}
+    manifest_path = os.path.join(directory, 'manifest.json')
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+        if manifest['params'] == params:
+            return manifest['documents']
+
+    os.makedirs(directory, exist_ok=True)
+    documents = []
+    for i in range(count):
+        rng = random.Random(seed * 100003 + i)
+        # The generator draws grades and noise from the global generators
+        random.seed(rng.random())
+        np.random.seed(rng.randrange(2 ** 32))
+
+        spi = f'{rng.uniform(5, 10):.2f}'
+        cpi = f'{rng.uniform(5, 10):.2f}'
+        variation = {'scale': rng.choice(scales), 'noise': rng.choice(noise), 'skew': rng.choice(skew),
+                     'jpeg_quality': rng.choice(jpeg_quality), 'pdf': bool(pdf_every) and i % pdf_every == pdf_every - 1}
+
+        source = os.path.join(directory, f'_source_{i}.png')
+        with contextlib.redirect_stdout(io.StringIO()):
+            generate_sample_marksheet(f'Student {i}', f'B{100000 + i}', str(rng.randint(1, 8)), spi, cpi, source)
+        image = Image.open(source).convert('RGB')
+        os.remove(source)
+
+        if variation['scale'] != 1.0:
+            image = image.resize((int(image.width * variation['scale']), int(image.height * variation['scale'])),
+                                 Image.LANCZOS)
+        if variation['skew']:
+            image = image.rotate(variation['skew'], resample=Image.BICUBIC, expand=True, fillcolor='white')
+        if variation['noise']:
+            pixels = np.asarray(image, dtype=np.float32)
+            pixels += np.random.normal(0, variation['noise'], pixels.shape)
+            image = Image.fromarray(np.clip(pixels, 0, 255).astype(np.uint8))
+
+        if variation['pdf']:
+            filename = f'marksheet_{i:04d}.pdf'
+            image.save(os.path.join(directory, filename), 'PDF', resolution=150 * variation['scale'])
+        else:
+            filename = f'marksheet_{i:04d}.jpg'
+            image.save(os.path.join(directory, filename), 'JPEG', quality=variation['jpeg_quality'])
+        documents.append({'file': filename, 'spi': spi, 'cpi': cpi, **variation})
+
+    with open(manifest_path, 'w', encoding='utf-8') as f:
+        json.dump({'params': params, 'documents': documents}, f, indent=2)
+    return documents
+
+
+def _same_value(found, expected):
+    if expected is None:
+        return found is None
+    try:
+        return found is not None and abs(float(found) - float(expected)) < 0.005
+    except ValueError:
+        return False
+
+
+def percentile(values, fraction):
+    if not values:
+        return None
+    return float(np.percentile(values, fraction * 100))
+
+
+def run_mode(mode, directory, documents, concurrency=1, warm_up=False):
+    """Run the corpus through one pipeline mode (in the calling process) and summarize it.
+
+    The process is expected to be fresh: importing the pipeline is timed as
+    the cold start, and with `warm_up` the pipeline is warmed up (and timed)
+    before the first document.
+    """
+    start = time.perf_counter()
+    import pipeline as pipeline_module
+    import_seconds = time.perf_counter() - start
+
+    config = {stage: dict(options) for stage, options in MODES[mode].items()}
+    config['cache'] = {'enabled': False}
+    pipeline = pipeline_module.MarksheetPipeline(config)
+    warm_up_seconds = pipeline_module.warm_up(pipeline) if warm_up else None
+
+    def process(document):
+        with open(os.path.join(directory, document['file']), 'rb') as f:
+            data = f.read()
+        start = time.perf_counter()
+        try:
+            result = pipeline.run(data, document['file'])
+        except Exception as e:
+            result = {'error': str(e)}
+        return document, time.perf_counter() - start, result
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        runs = list(executor.map(process, documents))
+    elapsed = time.perf_counter() - start
+
+    latencies = [seconds * 1000 for _, seconds, _ in runs]
+    failures = sum(1 for _, _, result in runs if 'error' in result)
+    correct = {'spi': 0, 'cpi': 0, 'document': 0}
+    misses = []
+    for document, _, result in runs:
+        fields = {field: _same_value(result.get(field), document[field]) for field in ('spi', 'cpi')}
+        for field, ok in fields.items():
+            correct[field] += ok
+        correct['document'] += all(fields.values())
+        if not all(fields.values()):
+            misses.append({'file': document['file'], 'expected': [document['spi'], document['cpi']],
+                           'found': [result.get('spi'), result.get('cpi')], 'error': result.get('error')})
+
+    summary = {
+        'documents': len(runs),
+        'import_ms': import_seconds * 1000,
+        'warm_up_ms': warm_up_seconds * 1000 if warm_up else None,
+        # The first document submitted (with concurrency > 1 it shares the process with others)
+        'first_ms': latencies[0] if latencies else None,
+        'failures': failures,
+        'p50_ms': percentile(latencies, 0.5),
+        'p95_ms': percentile(latencies, 0.95),
+        'mean_ms': float(np.mean(latencies)) if latencies else None,
+        'docs_per_sec': len(runs) / elapsed if elapsed else None,
+        'mean_ocr_attempts': float(np.mean([result.get('ocr_attempts', 0) for _, _, result in runs])) if runs else None,
+        # Summed over the OCR worker threads, like the stage timings themselves
+        'mean_preprocess_ms': float(np.mean([result.get('timings', {}).get('stages_ms', {}).get('preprocess', 0)
+                                             for _, _, result in runs])) if runs else None,
+        'accuracy': {key: value / len(runs) for key, value in correct.items()} if runs else {},
+        'misses': misses
+    }
+    if resource is not None:
+        # ru_maxrss is in KB on Linux; tesseract processes count as children
+        summary['peak_rss_mb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        summary['peak_child_rss_mb'] = resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024
+    return summary
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip()
+    except Exception:
+        return None
+
+
+def print_comparison(report, baseline):
+    print(f"\nCompared to {baseline.get('commit') or 'baseline'}:")
+    for mode, summary in report['modes'].items():
+        before = baseline.get('modes', {}).get(mode)
+        if not before:
+            continue
+        changes = []
+        for key in ('import_ms', 'first_ms', 'p50_ms', 'p95_ms', 'docs_per_sec', 'mean_preprocess_ms', 'peak_rss_mb'):
+            if summary.get(key) and before.get(key):
+                changes.append(f'{key} {100 * (summary[key] / before[key] - 1):+.1f}%')
+        accuracy = summary['accuracy'].get('document', 0) - before.get('accuracy', {}).get('document', 0)
+        changes.append(f'accuracy {100 * accuracy:+.1f} pts')
+        print(f'{mode:<18} ' + ', '.join(changes))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the marksheet pipeline on a synthetic corpus')
+    parser.add_argument('--count', type=int, default=24, help='number of documents in the corpus')
+    parser.add_argument('--seed', type=int, default=0, help='corpus seed')
+    parser.add_argument('--corpus', default=os.path.join('uploads', 'bench_corpus'), help='corpus directory')
+    parser.add_argument('--samples', action='store_true',
+                        help='benchmark the sample scans in the repository instead of a generated corpus')
+    parser.add_argument('--modes', default='parallel,parallel_full,serial,cascade',
+                        help=f'comma-separated modes ({", ".join(MODES)})')
+    parser.add_argument('--concurrency', type=int, default=1, help='documents processed at once')
+    parser.add_argument('--warm-up', action='store_true',
+                        help='warm up each pipeline (pipeline.warm_up) before its first document')
+    parser.add_argument('--output', help='write the report as JSON to this file')
+    parser.add_argument('--compare', help='JSON report of an earlier run to compare against')
+    args = parser.parse_args()
+
+    modes = [mode.strip() for mode in args.modes.split(',') if mode.strip()]
+    unknown = set(modes) - set(MODES)
+    if unknown:
+        parser.error(f'unknown modes: {", ".join(sorted(unknown))}')
+
+    if args.samples:
+        directory = os.path.dirname(os.path.abspath(__file__))
+        documents = SAMPLES
+        corpus = 'samples'
+    else:
+        directory = args.corpus
+        documents = generate_corpus(directory, args.count, args.seed)
+        corpus = {'count': args.count, 'seed': args.seed}
+    report = {'commit': git_commit(), 'created': time.time(), 'corpus': corpus,
+              'concurrency': args.concurrency, 'warm_up': args.warm_up, 'modes': {}}
+
+    print(f"{'mode':<18} {'import':>7} {'first':>7} {'p50 ms':>8} {'p95 ms':>8} {'docs/s':>7} {'attempts':>8} {'prep ms':>8} {'RSS MB':>7} "
+          f"{'spi':>5} {'cpi':>5} {'docs':>5} {'failed':>6}")
+    for mode in modes:
+        # A fresh process per mode: separate peak RSS, no state shared between modes
+        with ProcessPoolExecutor(max_workers=1) as executor:
+            summary = executor.submit(run_mode, mode, directory, documents, args.concurrency,
+                                      args.warm_up).result()
+        report['modes'][mode] = summary
+        accuracy = summary['accuracy']
+        print(f"{mode:<18} {summary['import_ms']:>7.0f} {summary['first_ms']:>7.0f} {summary['p50_ms']:>8.0f} {summary['p95_ms']:>8.0f} {summary['docs_per_sec']:>7.2f} "
+              f"{summary['mean_ocr_attempts']:>8.1f} {summary['mean_preprocess_ms']:>8.0f} "
+              f"{summary.get('peak_rss_mb') or 0:>7.0f} "
+              f"{accuracy['spi']:>5.0%} {accuracy['cpi']:>5.0%} {accuracy['document']:>5.0%} {summary['failures']:>6}")
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            print_comparison(report, json.load(f))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,370 @@
+"""Regex extraction of marksheet fields from OCR text.
+
+Every pattern is compiled once at import. Each extractor scans its text once
+(TextScan) to record where each label word and each run of digits starts;
+the resolvers then only run short anchored matches at those positions
+instead of searching the whole text once per pattern. Extraction
+cost is therefore linear in the length of the text, however many OCR
+attempts were joined into it. The fields found are the same as with the
+original per-pattern searches.
+"""
+import re
+from bisect import bisect_left
+
+
+# Three digits that should have been a GPA (798 -> 7.98). The old per-number
+# fixes (782, 856, ...) are all covered by this one substitution.
+MISSING_DECIMAL_PATTERN = re.compile(r'\b([6789])(\d{2})\b')
+
+LABELS = ['semester', 'cumulative', 'sgpa', 'cgpa', 'spi', 'cpi', 'gpa',
+          'percentage', 'total', 'result', 'grade', 'cbse', 'icse', 'state', 'board']
+# Case-insensitive label search for non-ASCII text, where lower() may not
+# keep positions; zero-width so overlapping labels (the GPA in SGPA) all match
+LABEL_PATTERN = re.compile(r'(?=(%s))' % '|'.join(LABELS), re.IGNORECASE)
+DIGITS_PATTERN = re.compile(r'\d+')
+WORD_CHAR_PATTERN = re.compile(r'\w')
+PERFORMANCE_PATTERN = re.compile(r'\s*performance', re.IGNORECASE)
+
+# College: a GPA right after a label, or right before it
+GPA_AFTER_PATTERN = re.compile(r'[\s:]*([0-9]\.[0-9]{1,2})')
+GPA_BEFORE_PATTERN = re.compile(r'([0-9]\.[0-9]{1,2})\s*\Z')
+GPA_BEFORE_WINDOW = 16
+TABLE_ROW_PATTERN = re.compile(r'(\d+)\s+(\d+)\s+(\d+)\s+(\d+\.\d+)(?:\s+\d+\s+\d+\s+\d+\s+(\d+\.\d+))?')
+
+# School: a percentage followed by a suffix, or following a label
+PERCENTAGE_SUFFIX_PATTERNS = {
+    0: ('%', re.compile(r'(\d+\.?\d*)\s*%')),
+    5: ('percent', re.compile(r'(\d+\.?\d*)\s*percent', re.IGNORECASE)),
+    6: ('per', re.compile(r'(\d+\.?\d*)\s*per\s*cent', re.IGNORECASE)),
+}
+PERCENTAGE_LABELS = {1: 'percentage', 2: 'total', 3: 'result', 4: 'grade'}
+LABEL_NUMBER_PATTERN = re.compile(r'[:\s]*(\d+\.?\d*)')
+NUMBER_PATTERN = re.compile(r'\d+\.?\d*')
+BOARD_LABELS = [('cbse',), ('icse',), ('state', 'board')]
+# Words naming the exam of a percentage, looked for shortly before it
+PERCENTAGE_QUALIFIERS = {
+    'percentage_10th': ('10th', 'tenth', 'x', 'ssc', 'sslc'),
+    'percentage_12th': ('12th', 'twelfth', 'xii', 'hsc'),
+}
+QUALIFIER_FIELDS = {word: field for field, words in PERCENTAGE_QUALIFIERS.items() for word in words}
+QUALIFIER_PATTERN = re.compile(r'\b(%s)\b' % '|'.join(QUALIFIER_FIELDS), re.IGNORECASE)
+QUALIFIER_WINDOW = 40
+
+DETECT_PERCENTAGE_PATTERN = re.compile(r'\d+\.?\d*\s*%')
+COLLEGE_KEYWORDS = ['SPI', 'CPI', 'SGPA', 'CGPA', 'SEMESTER', 'CUMULATIVE', 'CREDITS', 'GRADE POINTS']
+SCHOOL_KEYWORDS = ['10TH', '12TH', 'TENTH', 'TWELFTH', 'CLASS X', 'CLASS XII', 'SECONDARY', 'HIGHER SECONDARY']
+# Header words that also tell the types apart, for classify_marksheet_type
+HEADER_COLLEGE_KEYWORDS = ['UNIVERSITY', 'INSTITUTE', 'B.TECH', 'DEGREE']
+HEADER_SCHOOL_KEYWORDS = ['CBSE', 'ICSE', 'BOARD', 'SCHOOL']
+
+
+class TextScan:
+    """Start positions of every label and run of digits in a text"""
+
+    def __init__(self, text):
+        self.text = text
+        self.labels = {label: [] for label in LABELS}
+        self.numbers = [match.span() for match in DIGITS_PATTERN.finditer(text)]
+        self.lowered = None
+
+        if text.isascii():
+            # Plain substring search on the lower-cased text is far cheaper
+            # than a case-insensitive regex tried at every position
+            self.lowered = lowered = text.lower()
+            for label, starts in self.labels.items():
+                start = lowered.find(label)
+                while start != -1:
+                    starts.append(start)
+                    start = lowered.find(label, start + 1)
+        else:
+            for match in LABEL_PATTERN.finditer(text):
+                self.labels[match.group(1).lower()].append(match.start())
+
+    def spans(self, label):
+        return [(start, start + len(label)) for start in self.labels[label]]
+
+    def words(self, label):
+        """Spans of `label` standing as a whole word (regex \\b on both sides)"""
+        text = self.text
+        return [(start, end) for start, end in self.spans(label)
+                if not (start and WORD_CHAR_PATTERN.match(text, start - 1))
+                and not WORD_CHAR_PATTERN.match(text, end)]
+
+    def decimals(self):
+        """Every `\\d+\\.\\d+` number, left to right"""
+        text = self.text
+        numbers = self.numbers
+        values = []
+        i = 0
+        while i < len(numbers):
+            start, end = numbers[i]
+            if i + 1 < len(numbers) and numbers[i + 1][0] == end + 1 and text[end] == '.':
+                values.append(text[start:numbers[i + 1][1]])
+                i += 2
+            else:
+                i += 1
+        return values
+
+    def number_matches(self, pattern, starts=None):
+        """Non-overlapping matches of a pattern that starts with a number,
+        tried at `starts` (every number by default)"""
+        consumed = 0
+        for start in starts if starts is not None else (start for start, _ in self.numbers):
+            if start < consumed:
+                continue
+            match = pattern.match(self.text, start)
+            if match:
+                consumed = match.end()
+                yield match
+
+    def suffixed_matches(self, pattern, suffix):
+        """number_matches for a `number\\s*suffix` pattern, only trying the
+        numbers that end right before an occurrence of `suffix`"""
+        if self.lowered is None:
+            return self.number_matches(pattern)
+
+        text = self.text
+        number_starts = [start for start, _ in self.numbers]
+        starts = []
+        position = self.lowered.find(suffix)
+        while position != -1:
+            # Walk back over the spaces and the digits and dots of the number
+            end = position
+            while end and text[end - 1].isspace():
+                end -= 1
+            begin = end
+            while begin and (text[begin - 1].isdigit() or text[begin - 1] == '.'):
+                begin -= 1
+            starts.extend(number_starts[bisect_left(number_starts, begin):bisect_left(number_starts, end)])
+            position = self.lowered.find(suffix, position + 1)
+        return self.number_matches(pattern, sorted(set(starts)))
+
+
+def fix_missing_decimal_points(text):
+    """Post-processing function to fix common OCR errors with decimal points"""
+    return MISSING_DECIMAL_PATTERN.sub(r'\1.\2', text)
+
+
+def _gpa_after(text, end):
+    match = GPA_AFTER_PATTERN.match(text, end)
+    return match.group(1) if match else None
+
+
+def _gpa_before(text, start):
+    match = GPA_BEFORE_PATTERN.search(text, max(0, start - GPA_BEFORE_WINDOW), start)
+    return match.group(1) if match else None
+
+
+def _first_after(text, spans):
+    """GPA of the first label directly followed by one (`Label[\\s:]*value`)"""
+    return next((value for value in (_gpa_after(text, end) for _, end in spans) if value), None)
+
+
+def _first_before(text, spans):
+    """GPA of the first label directly preceded by one (`value\\s*Label`)"""
+    return next((value for value in (_gpa_before(text, start) for start, _ in spans) if value), None)
+
+
+def _first_in_window(text, anchor_ends, spans, width):
+    """GPA after the first label starting within `width` characters after an
+    anchor (`Anchor[\\s\\S]{0,width}?Label[\\s:]*value`)"""
+    for anchor_end in anchor_ends:
+        i = bisect_left(spans, (anchor_end,))
+        while i < len(spans) and spans[i][0] <= anchor_end + width:
+            value = _gpa_after(text, spans[i][1])
+            if value:
+                return value
+            i += 1
+    return None
+
+
+def _labeled_gpas(scan, keyword, label, alternate, width):
+    """First match of each label pattern for one field, in priority order"""
+    text = scan.text
+    keywords = scan.spans(keyword)
+    labels = scan.words(label)
+    performance = [match.end() for match in (PERFORMANCE_PATTERN.match(text, end) for _, end in keywords) if match]
+
+    yield _first_in_window(text, performance, labels, width)
+    yield _first_after(text, labels)
+    yield _first_before(text, labels)
+    yield _first_after(text, scan.words(alternate))
+    yield _first_in_window(text, [end for _, end in keywords], scan.spans('gpa'), 80)
+
+
+def _first_valid_gpa(values):
+    for value in values:
+        if value and 0 < float(value) <= 10:
+            return value
+    return None
+
+
+def extract_college_marksheet_data(text):
+    """Extract SPI and CPI from college marksheets"""
+    # First, fix potential decimal point issues, then clean up the text
+    text = ' '.join(fix_missing_decimal_points(text).split())
+    scan = TextScan(text)
+
+    # Method 1: Label-aware matches (prefer the layout typical of Sarvajanik)
+    spi = _first_valid_gpa(_labeled_gpas(scan, 'semester', 'spi', 'sgpa', 160))
+    cpi = _first_valid_gpa(_labeled_gpas(scan, 'cumulative', 'cpi', 'cgpa', 200))
+
+    # Method 2: Table structure analysis
+    for match in scan.number_matches(TABLE_ROW_PATTERN):
+        if spi and cpi:
+            break
+        potential_spi, potential_cpi = match.group(4), match.group(5)
+        if not spi and 0 < float(potential_spi) <= 10:
+            spi = potential_spi
+        if not cpi and potential_cpi and 0 < float(potential_cpi) <= 10:
+            cpi = potential_cpi
+
+    # Method 3: Context-based extraction
+    if not spi or not cpi:
+        valid_gpa_numbers = [num for num in scan.decimals() if 0 < float(num) <= 10]
+
+        if not spi and (scan.labels['semester'] or scan.labels['sgpa']) and valid_gpa_numbers:
+            spi = valid_gpa_numbers[0]
+        if not cpi and (scan.labels['cumulative'] or scan.labels['cgpa']):
+            cpi = next((num for num in valid_gpa_numbers if num != spi), None)
+
+        # If still not found, use positional logic
+        if valid_gpa_numbers:
+            if not spi:
+                spi = valid_gpa_numbers[0]
+            if not cpi and len(valid_gpa_numbers) >= 2:
+                cpi = valid_gpa_numbers[-1]
+
+    # If SPI and CPI are identical, try to refine CPI using stricter CPI-only patterns
+    if spi and cpi and spi == cpi:
+        cpi_words = scan.words('cpi')
+        performance = [match.end() for match in (PERFORMANCE_PATTERN.match(text, end)
+                                                 for _, end in scan.spans('cumulative')) if match]
+        for value in (_first_after(text, cpi_words), _first_in_window(text, performance, cpi_words, 200)):
+            if value and 0 < float(value) <= 10 and value != spi:
+                cpi = value
+                break
+
+    return {
+        'spi': spi,
+        'cpi': cpi,
+        'raw_text': text
+    }
+
+
+def _percentage_matches(scan):
+    """(number position, pattern index, value) of every percentage-like match"""
+    text = scan.text
+    for index, (suffix, pattern) in PERCENTAGE_SUFFIX_PATTERNS.items():
+        for match in scan.suffixed_matches(pattern, suffix):
+            yield match.start(), index, match.group(1)
+    for index, label in PERCENTAGE_LABELS.items():
+        for start, end in scan.spans(label):
+            match = LABEL_NUMBER_PATTERN.match(text, end)
+            if match:
+                yield match.start(1), index, match.group(1)
+
+
+def _board_values(scan, labels):
+    """Numbers following board names (`Board.*?(\\d+\\.?\\d*)`)"""
+    number_starts = [start for start, _ in scan.numbers]
+    consumed = 0
+    for start, end in sorted(span for label in labels for span in scan.spans(label)):
+        if start < consumed:
+            continue
+        i = bisect_left(number_starts, end)
+        if i == len(number_starts):
+            return
+        match = NUMBER_PATTERN.match(scan.text, number_starts[i])
+        consumed = match.end()
+        yield match.group(0)
+
+
+def extract_school_marksheet_data(text):
+    """Extract percentage from 10th and 12th marksheets"""
+    # Clean up the text
+    text = ' '.join(text.split())
+    scan = TextScan(text)
+
+    percentage_10th = None
+    percentage_12th = None
+
+    # Method 1: Pattern-based extraction, ordered by position in the text; a
+    # number matched by several patterns ("Percentage 78.00%") counts once
+    numbers = {}
+    for position, _, value in sorted(_percentage_matches(scan)):
+        if 0 <= float(value) <= 100:
+            numbers.setdefault(position, float(value))
+
+    # Method 2: A percentage shortly after the name of its exam ("12th
+    # Percentage 85.00") is that exam's; the others are taken positionally,
+    # assuming the first is 10th and the second is 12th
+    fields = {}
+    unqualified = []
+    previous = 0
+    for position in sorted(numbers):
+        qualifiers = QUALIFIER_PATTERN.findall(text, max(previous, position - QUALIFIER_WINDOW), position)
+        field = QUALIFIER_FIELDS[qualifiers[-1].lower()] if qualifiers else None
+        if field and field not in fields:
+            fields[field] = numbers[position]
+        else:
+            unqualified.append(numbers[position])
+        previous = position
+    fields.update(zip([field for field in PERCENTAGE_QUALIFIERS if field not in fields], unqualified))
+    if 'percentage_10th' in fields:
+        percentage_10th = f"{fields['percentage_10th']:.2f}"
+    if 'percentage_12th' in fields:
+        percentage_12th = f"{fields['percentage_12th']:.2f}"
+
+    # Method 3: Look for specific board patterns
+    # CBSE, ICSE, State boards often have specific formats
+    for labels in BOARD_LABELS:
+        for value in _board_values(scan, labels):
+            percentage_float = float(value)
+            if 0 <= percentage_float <= 100:
+                if not percentage_10th:
+                    percentage_10th = f"{percentage_float:.2f}"
+                elif not percentage_12th:
+                    percentage_12th = f"{percentage_float:.2f}"
+
+    return {
+        'percentage_10th': percentage_10th,
+        'percentage_12th': percentage_12th,
+        'raw_text': text
+    }
+
+
+def detect_marksheet_type(text):
+    """Detect whether the marksheet is college or school level"""
+    text_upper = text.upper()
+
+    # College and school indicators
+    college_count = sum(1 for keyword in COLLEGE_KEYWORDS if keyword in text_upper)
+    school_count = sum(1 for keyword in SCHOOL_KEYWORDS if keyword in text_upper)
+
+    # Decision logic
+    if college_count > school_count or ('SPI' in text_upper or 'CPI' in text_upper):
+        return 'college'
+    elif school_count > 0 or DETECT_PERCENTAGE_PATTERN.search(text_upper):
+        return 'school'
+    else:
+        # Default to college if uncertain
+        return 'college'
+
+
+def classify_marksheet_type(text):
+    """Classify a partial OCR text (a header or a low-resolution pass) as college or school.
+
+    Returns (type, confidence), the confidence going from 0 to 1 with the
+    margin of indicators for the winning type. Unlike detect_marksheet_type
+    there is no default: text without indicators gets a confidence of 0.
+    """
+    text_upper = text.upper()
+    college_count = sum(1 for keyword in COLLEGE_KEYWORDS + HEADER_COLLEGE_KEYWORDS if keyword in text_upper)
+    school_count = sum(1 for keyword in SCHOOL_KEYWORDS + HEADER_SCHOOL_KEYWORDS if keyword in text_upper)
+    if DETECT_PERCENTAGE_PATTERN.search(text_upper):
+        school_count += 1
+
+    marksheet_type = 'college' if college_count >= school_count else 'school'
+    confidence = abs(college_count - school_count) / (college_count + school_count + 1)
+    return marksheet_type, round(confidence, 2)
@@ -0,0 +1,136 @@
+"""Page geometry: orientation and skew correction before preprocessing.
+
+Phone photos of marksheets arrive a few degrees skewed or turned by 90/180
+degrees. The skew is estimated on a downscaled grayscale copy, from the table
+rulings and text baselines (Hough lines) or, on pages where too few lines
+stand out, from the text lines (minimum-area rectangles of the dilated text). The orientation comes
+from tesseract's orientation detection and is checked by the caller.
+PageGeometry then straightens the full-size page with a single rotation and
+warp, and maps boxes found on the straightened page back to input pixels.
+"""
+import cv2
+import numpy as np
+
+SKEW_MAX_ANGLE = 15.0  # Larger angles are treated as layout, not skew
+SKEW_MIN_ANGLE = 0.3  # Smaller skews are left alone
+SKEW_MIN_LINES = 3
+SKEW_TOP_LINES = 20
+# Lines disagreeing by more than this (interquartile range, degrees) come
+# from perspective or curled paper, which a rotation can't fix
+SKEW_MAX_SPREAD = 1.5
+# cv2.rotate code for each clockwise rotation
+ROTATE_CODES = {90: cv2.ROTATE_90_CLOCKWISE, 180: cv2.ROTATE_180, 270: cv2.ROTATE_90_COUNTERCLOCKWISE}
+
+
+def _weighted_quantile(values, weights, q):
+    order = np.argsort(values)
+    cumulative = np.cumsum(np.asarray(weights, dtype=np.float64)[order])
+    return float(np.asarray(values)[order][np.searchsorted(cumulative, cumulative[-1] * q)])
+
+
+def _consensus_angle(angles, weights):
+    """Length-weighted median angle, or 0.0 when the lines disagree"""
+    spread = _weighted_quantile(angles, weights, 0.75) - _weighted_quantile(angles, weights, 0.25)
+    if spread > SKEW_MAX_SPREAD:
+        return 0.0
+    return _weighted_quantile(angles, weights, 0.5)
+
+
+def estimate_skew(gray):
+    """Skew of the page in degrees (positive when lines descend to the right), or 0.0"""
+    height, width = gray.shape
+
+    # Table rulings and text baselines: the strongest near-horizontal lines
+    # of a Hough transform limited to the skew range (0.25 degree steps)
+    edges = cv2.Canny(gray, 50, 150)
+    max_theta = np.radians(SKEW_MAX_ANGLE)
+    lines = cv2.HoughLines(edges, 1, np.pi / 720, width // 3,
+                           min_theta=np.pi / 2 - max_theta, max_theta=np.pi / 2 + max_theta)
+    if lines is not None and len(lines) >= SKEW_MIN_LINES:
+        # Sorted by votes; theta is the angle of the line's normal
+        angles = np.degrees(lines.reshape(-1, 2)[:SKEW_TOP_LINES, 1]) - 90
+        return _consensus_angle(angles, np.ones(len(angles)))
+
+    # No rulings: merge the text into line blobs and measure their angle
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    blobs = cv2.dilate(binary, cv2.getStructuringElement(cv2.MORPH_RECT, (max(width // 60, 3), 1)))
+    contours, _ = cv2.findContours(blobs, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    angles, lengths = [], []
+    for contour in contours:
+        (_, _), (w, h), angle = cv2.minAreaRect(contour)
+        if w < h:
+            w, h, angle = h, w, angle - 90
+        # minAreaRect angles wrap around; bring them back near horizontal
+        angle = (angle + 90) % 180 - 90
+        if w >= width / 10 and w >= 5 * h and abs(angle) <= SKEW_MAX_ANGLE:
+            angles.append(angle)
+            lengths.append(w)
+    if len(angles) >= SKEW_MIN_LINES:
+        return _consensus_angle(angles, lengths)
+    return 0.0
+
+
+class PageGeometry:
+    """A clockwise rotation by a multiple of 90 degrees followed by a deskew.
+
+    `rotation` is the clockwise rotation in degrees (0, 90, 180 or 270) and
+    `skew` the skew corrected afterwards, as estimated by estimate_skew.
+    """
+
+    def __init__(self, rotation=0, skew=0.0):
+        self.rotation = rotation % 360
+        self.skew = skew if abs(skew) >= SKEW_MIN_ANGLE else 0.0
+
+    @property
+    def identity(self):
+        return self.rotation == 0 and self.skew == 0.0
+
+    def _skew_matrix(self, width, height):
+        """Affine deskew of a width x height page, and the size of the expanded output"""
+        matrix = cv2.getRotationMatrix2D((width / 2, height / 2), self.skew, 1.0)
+        cos, sin = abs(matrix[0, 0]), abs(matrix[0, 1])
+        out_width = int(round(height * sin + width * cos))
+        out_height = int(round(height * cos + width * sin))
+        matrix[0, 2] += out_width / 2 - width / 2
+        matrix[1, 2] += out_height / 2 - height / 2
+        return matrix, (out_width, out_height)
+
+    def apply(self, image):
+        """Straighten a page (BGR or grayscale)"""
+        if self.rotation:
+            image = cv2.rotate(image, ROTATE_CODES[self.rotation])
+        if self.skew:
+            height, width = image.shape[:2]
+            matrix, size = self._skew_matrix(width, height)
+            border = (255,) * (image.shape[2] if image.ndim == 3 else 1)
+            image = cv2.warpAffine(image, matrix, size, flags=cv2.INTER_LINEAR,
+                                   borderMode=cv2.BORDER_CONSTANT, borderValue=border)
+        return image
+
+    def matrix(self, width, height):
+        """3x3 transform from input pixels to straightened pixels for a width x height input"""
+        rotate = {
+            0: [[1, 0, 0], [0, 1, 0]],
+            90: [[0, -1, height - 1], [1, 0, 0]],
+            180: [[-1, 0, width - 1], [0, -1, height - 1]],
+            270: [[0, 1, 0], [-1, 0, width - 1]],
+        }[self.rotation]
+        transform = np.vstack([np.array(rotate, dtype=np.float64), [0, 0, 1]])
+        if self.skew:
+            rotated_width, rotated_height = (height, width) if self.rotation in (90, 270) else (width, height)
+            skew, _ = self._skew_matrix(rotated_width, rotated_height)
+            transform = np.vstack([skew, [0, 0, 1]]) @ transform
+        return transform
+
+    def box_to_input(self, box, width, height):
+        """Map a [left, top, width, height] box on the straightened page back to the width x height input"""
+        left, top, box_width, box_height = box
+        corners = np.array([[left, top, 1], [left + box_width, top, 1],
+                            [left, top + box_height, 1], [left + box_width, top + box_height, 1]], dtype=np.float64)
+        points = corners @ np.linalg.inv(self.matrix(width, height)).T
+        x0, y0 = np.floor(points[:, :2].min(axis=0))
+        x1, y1 = np.ceil(points[:, :2].max(axis=0))
+        return [int(x0), int(y0), int(x1 - x0), int(y1 - y0)]
+
+    def diagnostics(self):
+        return {'rotation': self.rotation, 'skew': round(self.skew, 2)}
@@ -0,0 +1,38 @@
+"""gunicorn settings for serving the app: gunicorn app:app
+
+The app is loaded once in the master (preload_app) and the workers are forked
+from it, so OpenCV, numpy, the pipeline and the layout registry are imported
+once and shared copy-on-write instead of being loaded again by every worker.
+Nothing started before the fork survives it (threads, tesseract engines,
+OpenCV's thread pool), so loading the app starts none of them: the worker
+pools start their threads on first use and the OCR backend, which loads the
+engines, is created on first use (pipeline.get_ocr_backend). With
+WARMUP_ON_BOOT=1 each worker starts them by warming up before it accepts
+requests; otherwise its first request does.
+"""
+import gc
+import os
+
+bind = os.getenv('GUNICORN_BIND', '0.0.0.0:8000')
+# Any worker can answer job polls as long as jobs are stored in SQLite
+# (JOB_STORE_PATH, the default); with in-memory jobs, run a single worker
+workers = int(os.getenv('GUNICORN_WORKERS') or 2)
+# The pipeline fans OCR out over its own pools; threads let a worker take
+# several uploads at once
+threads = int(os.getenv('GUNICORN_THREADS') or 4)
+# OCR of a large PDF can take a while
+timeout = int(os.getenv('GUNICORN_TIMEOUT') or 300)
+preload_app = True
+
+
+def when_ready(server):
+    # The app is loaded: move its objects out of the collector's reach, so
+    # collections in the workers don't write to (and copy) the shared pages
+    gc.freeze()
+
+
+def post_worker_init(worker):
+    from app import WARMUP_ON_BOOT, warm_up_worker
+
+    if WARMUP_ON_BOOT:
+        warm_up_worker()
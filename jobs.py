@@ -0,0 +1,174 @@
+"""In-process job queue for long-running extractions.
+
+A job wraps a function that produces keyed results one at a time (for example
+one result per document of a batch). Submitting returns a job id straight away
+while the function runs on a small pool of job runners; callers poll `get` for
+status, progress and whatever results are ready so far. Finished jobs are
+forgotten after `ttl` seconds.
+
+With a `path`, the status and results of every job are written to a SQLite
+file, so any worker process of a deployment can answer the polls for a job
+that another one accepted and runs (like the disk tier of the result cache).
+Without one, jobs live in the memory of the process that accepted them, and
+polling only works against that process. A job whose process dies while it
+runs stays 'running' until it expires.
+"""
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from functools import partial
+
+
+class Job:
+    def __init__(self, total):
+        self.id = uuid.uuid4().hex
+        self.status = 'queued'
+        self.total = total
+        self.results = {}
+        self.error = None
+        self.created = time.time()
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def add_result(self, key, result):
+        with self._lock:
+            self.results[key] = result
+
+    def to_dict(self):
+        with self._lock:
+            results = dict(self.results)
+        return {
+            'job_id': self.id,
+            'status': self.status,
+            'progress': {
+                'completed': len(results),
+                'total': self.total
+            },
+            'results': results,
+            'error': self.error,
+            'created': self.created,
+            'started': self.started,
+            'finished': self.finished
+        }
+
+
+class JobQueue:
+    def __init__(self, path=None, max_workers=2, ttl=3600):
+        self.path = path
+        self.ttl = ttl
+        self._jobs = {}
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS jobs ('
+                    'id TEXT PRIMARY KEY, status TEXT NOT NULL, total INTEGER NOT NULL, error TEXT, '
+                    'created REAL NOT NULL, started REAL, finished REAL)'
+                )
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS job_results ('
+                    'job_id TEXT NOT NULL, key TEXT NOT NULL, value TEXT NOT NULL, PRIMARY KEY (job_id, key))'
+                )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def submit(self, func, total):
+        """Queue `func(add_result)` and return the new job id.
+
+        `func` reports each result as it becomes available by calling
+        `add_result(key, result)`; `total` is the number of results expected.
+        With a `path`, results must be JSON-serializable.
+        """
+        self._expire()
+        job = Job(total)
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('INSERT INTO jobs (id, status, total, created) VALUES (?, ?, ?, ?)',
+                             (job.id, job.status, job.total, job.created))
+        else:
+            with self._lock:
+                self._jobs[job.id] = job
+        self._executor.submit(self._run, job, func)
+        return job.id
+
+    def get(self, job_id):
+        """Return a snapshot of the job as a dict, or None if it is unknown or expired"""
+        if not self.path:
+            with self._lock:
+                job = self._jobs.get(job_id)
+                return job.to_dict() if job is not None else None
+
+        with self._connect() as conn:
+            row = conn.execute('SELECT status, total, error, created, started, finished FROM jobs WHERE id = ?',
+                               (job_id,)).fetchone()
+            if row is None:
+                return None
+            results = {key: json.loads(value) for key, value in conn.execute(
+                'SELECT key, value FROM job_results WHERE job_id = ? ORDER BY rowid', (job_id,))}
+        status, total, error, created, started, finished = row
+        return {
+            'job_id': job_id,
+            'status': status,
+            'progress': {
+                'completed': len(results),
+                'total': total
+            },
+            'results': results,
+            'error': error,
+            'created': created,
+            'started': started,
+            'finished': finished
+        }
+
+    def _run(self, job, func):
+        self._update(job, status='running', started=time.time())
+        try:
+            func(partial(self._add_result, job))
+            self._update(job, status='completed', finished=time.time())
+        except Exception as e:
+            self._update(job, status='failed', error=str(e), finished=time.time())
+
+    def _update(self, job, **fields):
+        for name, value in fields.items():
+            setattr(job, name, value)
+        if self.path:
+            with self._connect() as conn:
+                conn.execute(f'UPDATE jobs SET {", ".join(f"{name} = ?" for name in fields)} WHERE id = ?',
+                             (*fields.values(), job.id))
+
+    def _add_result(self, job, key, result):
+        if not self.path:
+            job.add_result(key, result)
+            return
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO job_results (job_id, key, value) VALUES (?, ?, ?)',
+                         (job.id, key, json.dumps(result)))
+
+    def _expire(self):
+        cutoff = time.time() - self.ttl
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM job_results WHERE job_id IN '
+                             '(SELECT id FROM jobs WHERE finished < ?)', (cutoff,))
+                conn.execute('DELETE FROM jobs WHERE finished < ?', (cutoff,))
+            return
+        with self._lock:
+            for job_id in [job_id for job_id, job in self._jobs.items()
+                           if job.finished is not None and job.finished < cutoff]:
+                del self._jobs[job_id]
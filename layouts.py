@@ -0,0 +1,335 @@
+"""Registry of known marksheet layouts.
+
+Most documents come from a handful of layouts (the Sarvajanik university
+result sheet, CBSE/ICSE/state board marksheets). A Layout records how to
+recognize one of them and where its results are:
+
+    fingerprints  per sample page: a perceptual hash of the downscaled page,
+                  the positions of its table rulings and its aspect ratio
+    region        box around the result labels and values, in page fractions
+    attempt       the OCR attempt (variant and PSM) that reads the region best
+    anchors       words found in the region's text on every sample
+
+LayoutRegistry.match() compares a straightened page with every registered
+layout without any OCR. The pipeline then runs only the layout's attempt on
+its region, and falls back to the generic pipeline when that doesn't yield
+the fields or the anchors are missing from the text. Layouts are learned from
+a few labeled sample scans and stored as JSON.
+
+Usage: python layouts.py add NAME labels.json   (labels.json: {"scan.jpg": {"spi": "8.81", "cpi": "8.86"}, ...})
+       python layouts.py list
+       python layouts.py match scan.jpg [more files]
+       python layouts.py remove NAME
+"""
+import argparse
+import hashlib
+import json
+import os
+import sys
+from collections import Counter
+
+import cv2
+import numpy as np
+
+FINGERPRINT_WIDTH = 512
+HASH_SIZE = 8  # 8x8 low DCT frequencies -> 64-bit hash
+RULING_FRACTION = 8  # Rulings span at least 1/8 of the page
+RULING_TOLERANCE = 0.015  # Rulings this close (page fraction) are the same
+MIN_RULING_SCORE = 0.45  # Photos of the same layout score ~0.5, other layouts < 0.4
+ASPECT_TOLERANCE = 0.1
+MIN_ANCHOR_SHARE = 0.5  # Share of a layout's anchors the region text must contain
+REGION_MARGIN = 2  # Text lines of margin above and below the learned region
+REGION_MARGIN_X = 1  # Words (of median width) of margin left and right of it
+MAX_ANCHORS = 8
+FIELDS = {'college': ['spi', 'cpi'], 'school': ['percentage_10th', 'percentage_12th']}
+
+
+def _gray(image):
+    return cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+
+
+def perceptual_hash(gray):
+    """64-bit DCT hash: which low frequencies of a 32x32 thumbnail are above their median"""
+    small = cv2.resize(gray, (32, 32), interpolation=cv2.INTER_AREA).astype(np.float32)
+    low = cv2.dct(small)[:HASH_SIZE, :HASH_SIZE].flatten()
+    bits = low > np.median(low[1:])
+    return sum(1 << i for i, bit in enumerate(bits) if bit)
+
+
+def _run_centers(mask, size):
+    """Centers of the runs of True in a 1-D mask, as fractions of `size`"""
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], mask.astype(np.int8), [0]])))
+    return [round(float((start + end) / 2 / size), 4) for start, end in zip(edges[::2], edges[1::2])]
+
+
+def find_rulings(gray):
+    """Positions of the horizontal and vertical table rulings, as fractions of the page height and width"""
+    height, width = gray.shape
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    horizontal = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                  cv2.getStructuringElement(cv2.MORPH_RECT, (width // RULING_FRACTION, 1)))
+    vertical = cv2.morphologyEx(binary, cv2.MORPH_OPEN,
+                                cv2.getStructuringElement(cv2.MORPH_RECT, (1, height // RULING_FRACTION)))
+    return _run_centers(horizontal.any(axis=1), height), _run_centers(vertical.any(axis=0), width)
+
+
+def page_fingerprint(image):
+    """Fingerprint of a straightened page: {'hash', 'rows', 'columns', 'aspect'}"""
+    gray = _gray(image)
+    height, width = gray.shape
+    scale = min(1.0, FINGERPRINT_WIDTH / width)
+    if scale < 1.0:
+        gray = cv2.resize(gray, (FINGERPRINT_WIDTH, max(1, int(height * scale))), interpolation=cv2.INTER_AREA)
+    rows, columns = find_rulings(gray)
+    return {'hash': perceptual_hash(gray), 'rows': rows, 'columns': columns, 'aspect': round(height / width, 4)}
+
+
+def hash_distance(a, b):
+    return bin(a ^ b).count('1')
+
+
+def _ruling_score(expected, found):
+    """Share of the expected rulings that have a found ruling within RULING_TOLERANCE"""
+    if not expected:
+        return 1.0
+    if not found:
+        return 0.0
+    found = np.asarray(found)
+    return sum(np.abs(found - position).min() <= RULING_TOLERANCE for position in expected) / len(expected)
+
+
+def ruling_similarity(a, b):
+    """Agreement of the rulings of two fingerprints, from 0 to 1 (both ways, so extra rulings count too)"""
+    scores = [_ruling_score(a[key], b[key]) for key in ('rows', 'columns')] + \
+        [_ruling_score(b[key], a[key]) for key in ('rows', 'columns')]
+    return sum(scores) / len(scores)
+
+
+class Layout:
+    """A known marksheet layout; see the module docstring for its parts"""
+
+    def __init__(self, name, marksheet_type, fingerprints, region, attempt, anchors=()):
+        self.name = name
+        self.marksheet_type = marksheet_type
+        self.fingerprints = list(fingerprints)
+        self.region = list(region)  # [left, top, right, bottom] fractions
+        self.attempt = attempt
+        self.anchors = list(anchors)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(data['name'], data['marksheet_type'], data['fingerprints'], data['region'], data['attempt'],
+                   data.get('anchors', ()))
+
+    def to_dict(self):
+        return {'name': self.name, 'marksheet_type': self.marksheet_type, 'fingerprints': self.fingerprints,
+                'region': self.region, 'attempt': self.attempt, 'anchors': self.anchors}
+
+    def distance(self, fingerprint):
+        """Hash distance to the closest sample with the same shape and rulings, or None"""
+        distances = [hash_distance(sample['hash'], fingerprint['hash']) for sample in self.fingerprints
+                     if abs(sample['aspect'] - fingerprint['aspect']) <= ASPECT_TOLERANCE * sample['aspect']
+                     and ruling_similarity(sample, fingerprint) >= MIN_RULING_SCORE]
+        return min(distances) if distances else None
+
+    def region_box(self, width, height):
+        """The region in pixels of a width x height page, as (left, top, right, bottom)"""
+        left, top, right, bottom = self.region
+        return int(left * width), int(top * height), int(np.ceil(right * width)), int(np.ceil(bottom * height))
+
+    def has_anchors(self, text):
+        """Whether OCR text of the region contains enough of the layout's anchor words"""
+        if not self.anchors:
+            return True
+        words = {word.strip(':.,|()').upper() for word in text.split()}
+        return sum(anchor in words for anchor in self.anchors) >= MIN_ANCHOR_SHARE * len(self.anchors)
+
+
+class LayoutRegistry:
+    """Layouts kept in a JSON file (none when the file doesn't exist)"""
+
+    def __init__(self, path):
+        self.path = path
+        self.layouts = {}
+        if path and os.path.exists(path):
+            with open(path, encoding='utf-8') as f:
+                for data in json.load(f)['layouts']:
+                    self.layouts[data['name']] = Layout.from_dict(data)
+
+    def __len__(self):
+        return len(self.layouts)
+
+    def match(self, image, max_distance):
+        """The registered layout closest to a straightened page within `max_distance` hash bits, or None"""
+        if not self.layouts:
+            return None
+        fingerprint = page_fingerprint(image)
+        best, best_distance = None, max_distance + 1
+        for layout in self.layouts.values():
+            distance = layout.distance(fingerprint)
+            if distance is not None and distance < best_distance:
+                best, best_distance = layout, distance
+        return best
+
+    def fingerprint(self):
+        """Hash of the registered layouts, for result cache keys"""
+        data = json.dumps([self.layouts[name].to_dict() for name in sorted(self.layouts)], sort_keys=True)
+        return hashlib.sha256(data.encode('utf-8')).hexdigest()[:16]
+
+    def add(self, layout):
+        self.layouts[layout.name] = layout
+
+    def remove(self, name):
+        del self.layouts[name]
+
+    def save(self):
+        data = {'layouts': [self.layouts[name].to_dict() for name in sorted(self.layouts)]}
+        temp_path = self.path + '.tmp'
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=1)
+        os.replace(temp_path, self.path)
+
+
+def _same_value(found, expected):
+    if expected is None:
+        return not found
+    return bool(found) and float(found) == float(expected)
+
+
+def _reads_labels(result, labels):
+    return all(_same_value(result.get(field), expected) for field, expected in labels.items())
+
+
+def learn_layout(name, samples, pipeline):
+    """Learn a Layout from (page image, labels) samples, labels being {field: value or None}.
+
+    Every sample page is straightened and OCR'd with every attempt. The boxes
+    of the labeled values, and of the words on their text lines, in the
+    attempts that read them correctly make up the region. Every attempt then
+    runs again on the region of each sample, and the fastest one that reads
+    all samples correctly becomes the layout's attempt.
+    """
+    from metrics import StageTimings
+    from pipeline import OCR_ATTEMPT_NAMES, build_ocr_attempts, run_ocr_attempts
+
+    marksheet_type = 'college' if any(field in labels for _, labels in samples for field in FIELDS['college']) \
+        else 'school'
+    pages, fingerprints, boxes, line_heights, word_widths = [], [], [], [], []
+    for image, labels in samples:
+        geometry = pipeline.geometry(image, pipeline.config['geometry']['orientation'] != 'never')
+        page = geometry.apply(image)
+        pages.append(page)
+        fingerprints.append(page_fingerprint(page))
+
+        processed_images = pipeline.preprocess(page)
+        ocr_results, _, _ = run_ocr_attempts(build_ocr_attempts(processed_images), page.shape[1])
+        correct = [(words, result) for words, result in ocr_results if _reads_labels(result, labels)]
+        if not correct:
+            raise ValueError(f'No OCR attempt reads the labeled values of sample {len(pages)}')
+
+        page_height, page_width = page.shape[:2]
+        for words, result in correct:
+            for field, box in result.get('boxes', {}).items():
+                left, top, box_width, box_height = box
+                line_heights.append(box_height)
+                word_widths.append(box_width)
+                # The value and the words of its text line (its label)
+                on_line = np.abs((words.top + words.height / 2) - (top + box_height / 2)) <= box_height
+                word_widths.extend(words.width[on_line].tolist())
+                lefts = np.append(words.left[on_line], left)
+                rights = np.append(words.right[on_line], left + box_width)
+                boxes.append([lefts.min() / page_width, top / page_height,
+                              rights.max() / page_width, (top + box_height) / page_height])
+    if not boxes:
+        raise ValueError('The OCR attempts found no boxes for the labeled values')
+
+    boxes = np.asarray(boxes)
+    margin_x = REGION_MARGIN_X * float(np.median(word_widths)) / max(page.shape[1] for page in pages)
+    margin_y = REGION_MARGIN * float(np.median(line_heights)) / max(page.shape[0] for page in pages)
+    region = [max(0.0, boxes[:, 0].min() - margin_x), max(0.0, boxes[:, 1].min() - margin_y),
+              min(1.0, boxes[:, 2].max() + margin_x), min(1.0, boxes[:, 3].max() + margin_y)]
+    region = [round(float(value), 4) for value in region]
+    layout = Layout(name, marksheet_type, fingerprints, region, None)
+
+    # Every attempt on the region of every sample: which reads them all, and how fast
+    correct_counts, seconds, anchor_counts = Counter(), Counter(), Counter()
+    for page, (_, labels) in zip(pages, samples):
+        left, top, right, bottom = layout.region_box(page.shape[1], page.shape[0])
+        timings = StageTimings()
+        processed_images = pipeline.preprocess(page[top:bottom, left:right])
+        ocr_results, _, _ = run_ocr_attempts(build_ocr_attempts(processed_images), right - left, record=timings.record)
+        sample_anchors = set()
+        for words, result in ocr_results:
+            if _reads_labels(result, labels):
+                correct_counts[OCR_ATTEMPT_NAMES[int(words.attempt[0])]] += 1
+                sample_anchors.update(text.strip(':.,|()').upper() for text in words.text
+                                      if text.strip(':.,|()').isalpha() and len(text.strip(':.,|()')) >= 3)
+        anchor_counts.update(sample_anchors)
+        for stage, step, elapsed in timings.entries:
+            if stage == 'ocr':
+                seconds[step] += elapsed
+
+    candidates = [attempt for attempt, count in correct_counts.items() if count == len(samples)]
+    if not candidates:
+        raise ValueError('No single OCR attempt reads the region of every sample correctly')
+    layout.attempt = min(candidates, key=lambda attempt: seconds[attempt])
+    layout.anchors = [word for word, count in anchor_counts.most_common() if count == len(samples)][:MAX_ANCHORS]
+    return layout
+
+
+def _load_page(path):
+    from pipeline import PdfDocument, decode_image
+    with open(path, 'rb') as f:
+        data = f.read()
+    if path.lower().endswith('.pdf'):
+        with PdfDocument(data) as pdf:
+            return pdf.render_page(1)
+    return decode_image(data)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Manage the registry of known marksheet layouts')
+    parser.add_argument('--path', help='registry file (default: LAYOUTS_PATH)')
+    commands = parser.add_subparsers(dest='command', required=True)
+    add = commands.add_parser('add', help='learn a layout from labeled samples (replacing one of the same name)')
+    add.add_argument('name')
+    add.add_argument('labels', help='JSON object of sample path -> {field: value}; paths relative to this file')
+    commands.add_parser('list', help='list the registered layouts')
+    match = commands.add_parser('match', help='show which layout documents match')
+    match.add_argument('files', nargs='+')
+    remove = commands.add_parser('remove', help='remove a layout')
+    remove.add_argument('name')
+    args = parser.parse_args(argv)
+
+    from pipeline import LAYOUTS_PATH, MarksheetPipeline
+    registry = LayoutRegistry(args.path or LAYOUTS_PATH)
+    pipeline = MarksheetPipeline({'cache': {'enabled': False}, 'layout': {'enabled': False}})
+
+    if args.command == 'add':
+        with open(args.labels, encoding='utf-8') as f:
+            labels = json.load(f)
+        base = os.path.dirname(os.path.abspath(args.labels))
+        samples = [(_load_page(os.path.join(base, path)), values) for path, values in labels.items()]
+        layout = learn_layout(args.name, samples, pipeline)
+        registry.add(layout)
+        registry.save()
+        print(json.dumps({key: value for key, value in layout.to_dict().items() if key != 'fingerprints'}))
+    elif args.command == 'list':
+        for layout in registry.layouts.values():
+            print(f'{layout.name}: {layout.marksheet_type}, {len(layout.fingerprints)} samples, '
+                  f'attempt {layout.attempt}, region {layout.region}')
+    elif args.command == 'match':
+        max_distance = pipeline.config['layout']['max_distance']
+        for path in args.files:
+            image = _load_page(path)
+            page = pipeline.geometry(image).apply(image)
+            layout = registry.match(page, max_distance)
+            print(f'{path}: {layout.name if layout else "no match"}')
+    else:
+        registry.remove(args.name)
+        registry.save()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
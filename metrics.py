@@ -0,0 +1,217 @@
+"""Stage timings and Prometheus histograms.
+
+StageTimings collects the timings of one document from every thread working
+on it (OCR workers, page workers) and feeds each of them into a Histogram.
+Histograms are kept in process memory and rendered in the Prometheus text
+exposition format. With a MetricsStore, every process also writes its series
+to a SQLite file and a histogram renders the sum over all the processes, so
+any worker answers /metrics for the whole server.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+logger = logging.getLogger(__name__)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+class MetricsStore:
+    """Series of the histograms of every process, in a SQLite file.
+
+    Each process replaces its own rows (one per metric and label values) with
+    its current totals; `read` adds up the rows of all the processes. Rows of
+    processes that have exited are kept, so the counts cover every process
+    that has written to the file.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+        with self._connect() as conn:
+            conn.execute(
+                'CREATE TABLE IF NOT EXISTS series ('
+                'process TEXT NOT NULL, metric TEXT NOT NULL, labels TEXT NOT NULL, value TEXT NOT NULL, '
+                'PRIMARY KEY (process, metric, labels))'
+            )
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def write(self, process, metric, series):
+        """Store the series (label values -> values) of `metric` in `process`"""
+        if not series:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                'INSERT OR REPLACE INTO series (process, metric, labels, value) VALUES (?, ?, ?, ?)',
+                [(process, metric, json.dumps(label_values), json.dumps(values))
+                 for label_values, values in series.items()]
+            )
+
+    def read(self, metric):
+        """The series of `metric` summed over all processes"""
+        with self._connect() as conn:
+            rows = conn.execute('SELECT labels, value FROM series WHERE metric = ?', (metric,)).fetchall()
+        totals = {}
+        for labels, value in rows:
+            label_values, values = tuple(json.loads(labels)), json.loads(value)
+            total = totals.get(label_values)
+            totals[label_values] = values if total is None else [a + b for a, b in zip(total, values)]
+        return totals
+
+
+class Histogram:
+    """A Prometheus histogram with a fixed set of label names.
+
+    With a `store`, the series of this process are written to it at most every
+    `flush_interval` seconds and whenever the histogram is rendered, so the
+    other processes' counts are at most that old.
+    """
+
+    def __init__(self, name, documentation, label_names=(), buckets=DEFAULT_BUCKETS, store=None, flush_interval=1.0):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+        self.buckets = tuple(sorted(buckets))
+        self.store = store
+        self.flush_interval = flush_interval
+        self._start_process()
+        if store is not None:
+            # What the parent observed is its own: write it out before a fork
+            # and start the child from empty series
+            os.register_at_fork(before=self.flush, after_in_child=self._start_process)
+
+    def _start_process(self):
+        # Label values -> [count per bucket..., sum, count]
+        self._series = {}
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._flushed = 0.0
+        self._process = f'{os.getpid()}-{uuid.uuid4().hex}'
+
+    def observe(self, seconds, *label_values):
+        with self._lock:
+            series = self._series.get(label_values)
+            if series is None:
+                series = self._series[label_values] = [0] * len(self.buckets) + [0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if seconds <= bound:
+                    series[i] += 1
+            series[-2] += seconds
+            series[-1] += 1
+            due = self.store is not None and time.monotonic() - self._flushed >= self.flush_interval
+
+        if due and self._flush_lock.acquire(blocking=False):
+            try:
+                self._flush()
+            finally:
+                self._flush_lock.release()
+
+    def flush(self):
+        """Write the series of this process to the store"""
+        if self.store is None:
+            return
+        with self._flush_lock:
+            self._flush()
+
+    def _flush(self):
+        with self._lock:
+            series = {label_values: list(values) for label_values, values in self._series.items()}
+            self._flushed = time.monotonic()
+        try:
+            self.store.write(self._process, self.name, series)
+        except sqlite3.Error:
+            logger.warning('Could not write metric %s to %s', self.name, self.store.path, exc_info=True)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        if self.store is not None:
+            self.flush()
+            items = sorted(self.store.read(self.name).items())
+        else:
+            with self._lock:
+                items = sorted((label_values, list(series)) for label_values, series in self._series.items())
+
+        for label_values, series in items:
+            labels = ''.join(f'{name}="{_escape(value)}",' for name, value in zip(self.label_names, label_values))
+            for bound, count in zip(self.buckets, series):
+                lines.append(f'{self.name}_bucket{{{labels}le="{bound:g}"}} {count}')
+            lines.append(f'{self.name}_bucket{{{labels}le="+Inf"}} {series[-1]}')
+            labels = labels.rstrip(',')
+            lines.append(f'{self.name}_sum{{{labels}}} {series[-2]:.6f}')
+            lines.append(f'{self.name}_count{{{labels}}} {series[-1]}')
+        return '\n'.join(lines) + '\n'
+
+
+def render_metrics(*histograms):
+    return ''.join(histogram.render() for histogram in histograms)
+
+
+def format_timing_header(timings):
+    """Stage totals of StageTimings.as_dict() in Server-Timing syntax, e.g. 'decode;dur=31.2, ocr;dur=840.5, total;dur=512.0'"""
+    parts = [f'{stage};dur={ms}' for stage, ms in timings['stages_ms'].items()]
+    parts.append(f'total;dur={timings["total_ms"]}')
+    return ', '.join(parts)
+
+
+class StageTimings:
+    """Timings of the stages of one document.
+
+    `record(stage, seconds, step)` may be called from any thread; `step` names
+    the variant or OCR attempt within the stage. Stage totals add up the time
+    of every thread, so for parallel stages they exceed the wall-clock time.
+    """
+
+    def __init__(self, histogram=None):
+        self.histogram = histogram
+        self.entries = []
+        self._lock = threading.Lock()
+        self._start = time.perf_counter()
+        self._end = None
+
+    def record(self, stage, seconds, step=''):
+        with self._lock:
+            self.entries.append((stage, step, seconds))
+        if self.histogram is not None:
+            self.histogram.observe(seconds, stage, step)
+
+    def finish(self):
+        """Stop the wall clock of the document"""
+        self._end = time.perf_counter()
+
+    def elapsed(self):
+        return (self._end or time.perf_counter()) - self._start
+
+    def totals(self):
+        """Seconds per stage, in the order the stages first ran"""
+        totals = {}
+        with self._lock:
+            for stage, _, seconds in self.entries:
+                totals[stage] = totals.get(stage, 0.0) + seconds
+        return totals
+
+    def as_dict(self):
+        with self._lock:
+            steps = [{'stage': stage, 'step': step, 'ms': round(seconds * 1000, 1)}
+                     for stage, step, seconds in self.entries]
+        return {
+            'total_ms': round(self.elapsed() * 1000, 1),
+            'stages_ms': {stage: round(seconds * 1000, 1) for stage, seconds in self.totals().items()},
+            'steps': steps
+        }
@@ -0,0 +1,197 @@
+"""OCR engine backends.
+
+Every backend offers image_to_string(image, config) and image_to_data(image,
+config); the latter returns word boxes as a dict of parallel lists with the
+keys of DATA_KEYS, like pytesseract's Output.DICT. 'line' numbers the text
+lines of the image so words can be regrouped into lines.
+
+PytesseractBackend runs the tesseract binary once per call, which reloads the
+language model and round-trips the image through a temp file every time.
+TesserocrBackend keeps a pool of long-lived tesseract engines (through the
+tesserocr bindings to the tesseract C API) with the model already loaded and
+hands them numpy arrays directly, so those costs are paid once per engine
+instead of once per call. tesserocr is optional; without it the pytesseract
+backend is used.
+"""
+import queue
+import shlex
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+import pytesseract
+
+try:
+    import tesserocr
+except Exception:
+    tesserocr = None
+
+
+DATA_KEYS = ('text', 'left', 'top', 'width', 'height', 'conf', 'line')
+
+
+def parse_tesseract_config(config):
+    """Split a tesseract CLI config string into (page segmentation mode, {variable: value})"""
+    psm = None
+    variables = {}
+    args = shlex.split(config or '')
+    i = 0
+    while i < len(args):
+        arg = args[i]
+        if arg == '--psm' and i + 1 < len(args):
+            psm = int(args[i + 1])
+            i += 1
+        elif arg == '-c' and i + 1 < len(args):
+            name, _, value = args[i + 1].partition('=')
+            variables[name] = value
+            i += 1
+        elif arg.startswith('-c') and '=' in arg:
+            name, _, value = arg[2:].partition('=')
+            variables[name] = value
+        i += 1
+    return psm, variables
+
+
+def _as_array(image):
+    """Return a C-contiguous uint8 array for a numpy or PIL image"""
+    if not isinstance(image, np.ndarray):
+        image = np.asarray(image if image.mode in ('L', 'RGB') else image.convert('RGB'))
+    return np.ascontiguousarray(image, dtype=np.uint8)
+
+
+class PytesseractBackend:
+    name = 'pytesseract'
+
+    def __init__(self, lang='eng'):
+        self.lang = lang
+
+    def image_to_string(self, image, config=''):
+        return pytesseract.image_to_string(image, lang=self.lang, config=config)
+
+    def image_to_data(self, image, config=''):
+        data = pytesseract.image_to_data(image, lang=self.lang, config=config,
+                                         output_type=pytesseract.Output.DICT)
+        # Keep word-level rows only (tesseract reports block/line rows with conf -1)
+        words = [i for i, level in enumerate(data['level']) if level == 5]
+        line_ids = {}
+        for i in words:
+            line_ids.setdefault((data['block_num'][i], data['par_num'][i], data['line_num'][i]), len(line_ids))
+        data['line'] = [line_ids.get((data['block_num'][i], data['par_num'][i], data['line_num'][i]))
+                        for i in range(len(data['level']))]
+        return {key: [data[key][i] if key == 'text' else int(float(data[key][i])) for i in words]
+                for key in DATA_KEYS}
+
+
+class TesserocrBackend:
+    name = 'tesserocr'
+
+    def __init__(self, lang='eng', tessdata_path=None, pool_size=1):
+        if tesserocr is None:
+            raise RuntimeError('tesserocr is not installed. Install it or use the pytesseract backend.')
+        self.lang = lang
+        self.tessdata_path = tessdata_path
+        self.pool_size = pool_size
+        self._idle = queue.Queue()
+        self._created = 1
+        self._lock = threading.Lock()
+        # Load the first engine now so a broken install fails when the backend is created
+        self._idle.put(self._create_engine())
+
+    def _create_engine(self):
+        kwargs = {'lang': self.lang}
+        if self.tessdata_path:
+            kwargs['path'] = self.tessdata_path
+        return tesserocr.PyTessBaseAPI(**kwargs)
+
+    @contextmanager
+    def _engine(self):
+        try:
+            engine = self._idle.get_nowait()
+        except queue.Empty:
+            # Grow the pool up to pool_size engines, then wait for an idle one
+            with self._lock:
+                can_create = self._created < self.pool_size
+                if can_create:
+                    self._created += 1
+            if not can_create:
+                engine = self._idle.get()
+            else:
+                try:
+                    engine = self._create_engine()
+                except Exception:
+                    with self._lock:
+                        self._created -= 1
+                    raise
+        try:
+            yield engine
+        finally:
+            self._idle.put(engine)
+
+    @contextmanager
+    def _recognized(self, image, config):
+        """Yield an engine that has recognized `image` with the given config"""
+        psm, variables = parse_tesseract_config(config)
+        array = _as_array(image)
+        height, width = array.shape[:2]
+        channels = 1 if array.ndim == 2 else array.shape[2]
+
+        with self._engine() as engine:
+            # Variables stick to the engine, so restore them after this call
+            previous = {name: engine.GetVariableAsString(name) for name in variables}
+            try:
+                engine.SetPageSegMode(psm if psm is not None else tesserocr.PSM.AUTO)
+                for name, value in variables.items():
+                    engine.SetVariable(name, value)
+                engine.SetImageBytes(array.tobytes(), width, height, channels, width * channels)
+                engine.Recognize()
+                yield engine
+            finally:
+                engine.Clear()
+                for name, value in previous.items():
+                    if value is not None:
+                        engine.SetVariable(name, value)
+
+    def image_to_string(self, image, config=''):
+        with self._recognized(image, config) as engine:
+            return engine.GetUTF8Text()
+
+    def image_to_data(self, image, config=''):
+        data = {key: [] for key in DATA_KEYS}
+        with self._recognized(image, config) as engine:
+            iterator = engine.GetIterator()
+            level = tesserocr.RIL.WORD
+            line = -1
+            for word in tesserocr.iterate_level(iterator, level):
+                if word.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                box = word.BoundingBox(level)
+                if box is None:
+                    continue
+                x1, y1, x2, y2 = box
+                data['text'].append(word.GetUTF8Text(level) or '')
+                data['left'].append(x1)
+                data['top'].append(y1)
+                data['width'].append(x2 - x1)
+                data['height'].append(y2 - y1)
+                data['conf'].append(int(word.Confidence(level)))
+                data['line'].append(max(line, 0))
+        return data
+
+
+def create_ocr_backend(name='auto', lang='eng', tessdata_path=None, pool_size=1):
+    """Create the OCR backend called `name`: 'tesserocr', 'pytesseract' or 'auto'
+    (tesserocr when it is installed and loads, pytesseract otherwise)"""
+    name = (name or 'auto').lower()
+    if name == 'pytesseract':
+        return PytesseractBackend(lang)
+    if name == 'tesserocr':
+        return TesserocrBackend(lang, tessdata_path, pool_size)
+    if name != 'auto':
+        raise ValueError(f'Unknown OCR backend: {name}')
+
+    if tesserocr is not None:
+        try:
+            return TesserocrBackend(lang, tessdata_path, pool_size)
+        except Exception:
+            pass
+    return PytesseractBackend(lang)
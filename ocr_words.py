@@ -0,0 +1,130 @@
+"""Word-level OCR results in a compact columnar form.
+
+OcrWords keeps one NumPy array per column (text, box, confidence, attempt,
+line) instead of a list of dicts, so words from every OCR attempt of a page
+can be concatenated and filtered with vectorized masks. Boxes are stored in
+page coordinates: attempts run on rescaled variants are mapped back when the
+words are created.
+"""
+import numpy as np
+
+
+class OcrWords:
+    def __init__(self, text, left, top, width, height, conf, attempt, line):
+        self.text = np.asarray(text, dtype=object)
+        self.left = np.asarray(left, dtype=np.int32)
+        self.top = np.asarray(top, dtype=np.int32)
+        self.width = np.asarray(width, dtype=np.int32)
+        self.height = np.asarray(height, dtype=np.int32)
+        self.conf = np.asarray(conf, dtype=np.float32)
+        self.attempt = np.asarray(attempt, dtype=np.int32)
+        self.line = np.asarray(line, dtype=np.int32)
+
+    @classmethod
+    def from_data(cls, data, attempt=0, scale=1.0):
+        """Build from an OCR backend's image_to_data dict.
+
+        `scale` is the size of the OCR'd image relative to the page, so boxes
+        of an upscaled variant are divided back to page coordinates.
+        """
+        keep = [i for i, text in enumerate(data['text']) if text.strip()]
+
+        def column(key):
+            return np.asarray([data[key][i] for i in keep], dtype=np.float64)
+
+        return cls(
+            [data['text'][i].strip() for i in keep],
+            np.round(column('left') / scale),
+            np.round(column('top') / scale),
+            np.round(column('width') / scale),
+            np.round(column('height') / scale),
+            column('conf'),
+            np.full(len(keep), attempt),
+            column('line') if 'line' in data else np.zeros(len(keep))
+        )
+
+    @classmethod
+    def empty(cls):
+        return cls([], [], [], [], [], [], [], [])
+
+    @classmethod
+    def concat(cls, parts):
+        parts = list(parts)
+        if not parts:
+            return cls.empty()
+        return cls(*(np.concatenate([getattr(part, name) for part in parts])
+                     for name in ('text', 'left', 'top', 'width', 'height', 'conf', 'attempt', 'line')))
+
+    def __len__(self):
+        return len(self.text)
+
+    @property
+    def right(self):
+        return self.left + self.width
+
+    @property
+    def bottom(self):
+        return self.top + self.height
+
+    def box(self, index):
+        """[left, top, width, height] of one word as plain ints"""
+        return [int(self.left[index]), int(self.top[index]), int(self.width[index]), int(self.height[index])]
+
+    def to_text(self):
+        """Rebuild plain text: words joined by spaces, lines by newlines, attempts in order"""
+        lines = []
+        current = None
+        for text, attempt, line in zip(self.text, self.attempt, self.line):
+            if (attempt, line) != current:
+                lines.append([])
+                current = (attempt, line)
+            lines[-1].append(text)
+        return '\n'.join(' '.join(words) for words in lines)
+
+
+def normalize_words(words):
+    """Upper-cased word texts without surrounding label punctuation"""
+    return np.array([text.strip(':.,|()').upper() for text in words.text], dtype=object)
+
+
+def find_labeled_values(words, labels, is_value):
+    """Find the value next to each label word by spatial adjacency.
+
+    For every word whose normalized text is in `labels`, the value is the
+    closest word accepted by `is_value(text)` from the same attempt, either to
+    its right on the same text row or below it within the label's column.
+    Returns a list of (value index, label index) pairs.
+    """
+    if not len(words):
+        return []
+
+    normalized = normalize_words(words)
+    label_indices = np.flatnonzero(np.isin(normalized, list(labels)))
+    value_mask = np.array([is_value(text) for text in words.text], dtype=bool)
+    if not len(label_indices) or not value_mask.any():
+        return []
+
+    center_y = words.top + words.height / 2.0
+    center_x = words.left + words.width / 2.0
+    pairs = []
+    for i in label_indices:
+        candidates = value_mask & (words.attempt == words.attempt[i])
+        height = max(int(words.height[i]), 1)
+
+        # Same row: vertical centers within one label height, to the right
+        right = candidates & (np.abs(center_y - center_y[i]) <= height) & (words.left >= words.right[i] - height)
+        if right.any():
+            distance = np.where(right, words.left - words.right[i], np.iinfo(np.int32).max)
+            pairs.append((int(np.argmin(distance)), int(i)))
+            continue
+
+        # Same column: below the label, horizontally overlapping it, within a few rows
+        column_width = max(int(words.width[i]), height)
+        below = candidates & (words.top >= words.bottom[i] - height // 2) \
+            & (np.abs(center_x - center_x[i]) <= column_width) \
+            & (words.top - words.bottom[i] <= 6 * height)
+        if below.any():
+            distance = np.where(below, words.top - words.bottom[i], np.iinfo(np.int32).max)
+            pairs.append((int(np.argmin(distance)), int(i)))
+
+    return pairs
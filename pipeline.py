@@ -0,0 +1,1680 @@
+"""The marksheet extraction pipeline, independent of the web app.
+
+A document goes through these stages:
+
+    decode      uploaded bytes -> BGR page (PDFs: text_layer, then render, per page)
+    geometry    deskew the page and turn it upright
+    layout      match the page against the registry of known layouts
+    locate      find the band of the page holding the results (ROI)
+    classify    college or school, from the locate pass or the header band
+    numeric     digit-only OCR of the value cells next to the labels found
+    preprocess  lazy image variants for the OCR attempts
+    ocr         OCR attempts on the shared pool, each extracted on its own,
+                then voted on
+    aggregate   combine the pages of a PDF
+
+MarksheetPipeline runs them with per-stage settings and hooks; the Flask app,
+the command line below and batch tools all go through it. The shared worker
+pools, OCR backend and result cache live in this module, so every pipeline in
+a process shares them.
+
+Usage: python pipeline.py marksheet.jpg [more files] [--mode cascade] [--no-roi] [--timings]
+"""
+import os
+import re
+import sys
+import json
+import time
+import logging
+import uuid
+import argparse
+import tempfile
+import subprocess
+import threading
+from collections import Counter, deque
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from functools import partial
+import cv2
+import numpy as np
+import pytesseract
+from dotenv import load_dotenv
+
+from geometry import ROTATE_CODES, PageGeometry, estimate_skew
+from extraction import extract_college_marksheet_data, extract_school_marksheet_data, detect_marksheet_type, \
+    classify_marksheet_type, PERCENTAGE_QUALIFIERS
+from layouts import LayoutRegistry
+from metrics import Histogram, MetricsStore, StageTimings
+from ocr_backends import create_ocr_backend
+from ocr_words import OcrWords, find_labeled_values, normalize_words
+from result_cache import ResultCache
+
+# Load env and configure Tesseract path
+load_dotenv()
+TESSERACT_CMD = os.getenv('TESSERACT_CMD')
+if TESSERACT_CMD and os.path.exists(TESSERACT_CMD):
+    pytesseract.pytesseract.tesseract_cmd = TESSERACT_CMD
+else:
+    # Fall back to common defaults
+    if os.name == 'nt':
+        pytesseract.pytesseract.tesseract_cmd = r'C:\Program Files\Tesseract-OCR\tesseract.exe'
+    else:
+        pytesseract.pytesseract.tesseract_cmd = r'/usr/bin/tesseract'
+
+POPPLER_PATH = os.getenv('POPPLER_PATH')  # Optional, for Windows pdf2image
+
+# PDF pages are rendered one at a time at PDF_DPI and at most PDF_PAGE_WORKERS
+# pages are in flight at once. Requests may lower both the DPI and the page
+# count (form fields 'dpi' and 'max_pages') but not raise them.
+PDF_DPI = int(os.getenv('PDF_DPI') or 300)
+PDF_MAX_PAGES = int(os.getenv('PDF_MAX_PAGES') or 20)
+PDF_PAGE_WORKERS = int(os.getenv('PDF_PAGE_WORKERS') or 2)
+# Born-digital PDFs: read the embedded text layer with poppler's pdftotext
+# first and only rasterize pages whose text yields no fields
+PDF_TEXT_LAYER = os.getenv('PDF_TEXT_LAYER', '1') != '0'
+
+# Shared OCR worker pool. Tesseract runs as a subprocess, so threads are enough
+# to keep every core busy; the semaphore is a global cap on how many tesseract
+# processes may be alive at once across all concurrent uploads.
+OCR_WORKERS = int(os.getenv('OCR_WORKERS') or os.cpu_count() or 1)
+OCR_MAX_CONCURRENCY = int(os.getenv('OCR_MAX_CONCURRENCY') or OCR_WORKERS)
+ocr_executor = ThreadPoolExecutor(max_workers=OCR_WORKERS, thread_name_prefix='ocr')
+ocr_slots = threading.BoundedSemaphore(OCR_MAX_CONCURRENCY)
+
+# OCR engine: 'tesserocr' keeps one loaded engine per OCR slot, 'pytesseract'
+# starts the tesseract binary for every call, 'auto' prefers tesserocr. The
+# backend (and with it the first engine) is created on first use rather than
+# at import, so a server that loads the app before forking its workers
+# (gunicorn.conf.py) loads the engines in each worker, not in the master.
+OCR_BACKEND = os.getenv('OCR_BACKEND', 'auto')
+_ocr_backend = None
+_ocr_backend_lock = threading.Lock()
+
+def get_ocr_backend():
+    """The shared OCR backend, created on first use"""
+    global _ocr_backend
+    if _ocr_backend is None:
+        with _ocr_backend_lock:
+            if _ocr_backend is None:
+                _ocr_backend = create_ocr_backend(
+                    OCR_BACKEND,
+                    tessdata_path=os.getenv('TESSDATA_PREFIX'),
+                    pool_size=OCR_MAX_CONCURRENCY
+                )
+    return _ocr_backend
+
+# Documents of a batch request are processed concurrently on their own pool
+# (each document still fans its OCR attempts out over the OCR pool above)
+BATCH_WORKERS = int(os.getenv('BATCH_WORKERS') or OCR_WORKERS)
+document_executor = ThreadPoolExecutor(max_workers=BATCH_WORKERS, thread_name_prefix='document')
+
+# Pages of multi-page PDFs (separate from the document pool, whose workers
+# wait on them)
+page_executor = ThreadPoolExecutor(max_workers=PDF_PAGE_WORKERS * BATCH_WORKERS, thread_name_prefix='page')
+
+# Configuration optimized for table structure
+TABLE_CONFIGS = {
+    'psm6_whitelist': '--psm 6 -c tessedit_char_whitelist=0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZabcdefghijklmnopqrstuvwxyz.,: %',
+    'psm4': '--psm 4',
+    'psm6': '--psm 6',
+    'psm11': '--psm 11',
+    'psm3': '--psm 3'
+}
+
+# Preprocessed variants OCR'd with the default configuration
+OCR_VARIANTS = ['scaled_enhanced', 'scaled_sharp', 'thresh_gaussian', 'dilated', 'denoised', 'original_gray']
+
+# Every OCR attempt by name: (image variant, tesseract config). 'original' is the
+# upload without preprocessing (only resolution normalization). Dict order is
+# the order used by the parallel mode.
+OCR_ATTEMPTS = {f'enhanced_{name}': ('enhanced', config) for name, config in TABLE_CONFIGS.items()}
+OCR_ATTEMPTS.update({variant: (variant, '') for variant in OCR_VARIANTS})
+OCR_ATTEMPTS['original'] = ('original', '')
+OCR_ATTEMPT_NAMES = list(OCR_ATTEMPTS)
+
+OCR_ATTEMPT_SEPARATOR = '\n\n--- OCR ATTEMPT ---\n\n'
+
+# Resolution normalization: every variant is built from the page rescaled so
+# that its typical glyph height (capitals and digits, measured on connected
+# components) is OCR_TEXT_HEIGHT pixels, around the size tesseract reads best. Large photos are
+# downscaled, which bounds the OCR cost per page, and only small scans are
+# upscaled (after denoising, which is the expensive filter and never runs on
+# more than the input pixels). OCR_TEXT_HEIGHT=0 keeps the input resolution.
+OCR_TEXT_HEIGHT = int(os.getenv('OCR_TEXT_HEIGHT', '24'))
+TEXT_SCALE_LIMITS = (0.25, 3.0)
+TEXT_SCALE_TOLERANCE = 0.15  # Closer to 1 than this isn't worth a resize
+TEXT_MIN_GLYPHS = 20  # Fewer glyph-sized components give no reliable estimate
+
+# Denoising strategy: 'auto' estimates the noise of each page (Immerkaer's
+# method, away from text edges) and leaves clean scans alone, median-filters
+# mildly noisy ones and runs NL-means only on very noisy pages small enough
+# for it (result bands, small scans), using a bilateral filter on larger ones.
+# 'none', 'median', 'bilateral' or 'nlmeans' force one strategy.
+OCR_DENOISE = os.getenv('OCR_DENOISE', 'auto')
+DENOISE_SKIP_SIGMA = 3.0
+DENOISE_NLMEANS_SIGMA = 10.0
+DENOISE_NLMEANS_MAX_PIXELS = 2_000_000
+NOISE_KERNEL = np.array([[1, -2, 1], [-2, 4, -2], [1, -2, 1]], dtype=np.float32)
+
+# Value words accepted next to a result label
+GPA_WORD_PATTERN = re.compile(r'^\d\.\d{1,2}$')
+PERCENT_WORD_PATTERN = re.compile(r'^(\d{1,3}(?:\.\d{1,2})?)%?$')
+
+# Page geometry: every page is first deskewed (angle of the table rulings or
+# text lines on a GEOMETRY_WIDTH-pixel-wide copy) and turned upright, with a
+# single warp of the full-size page. GEOMETRY_ORIENTATION 'auto' asks
+# tesseract's orientation detection (needs osd.traineddata) about landscape
+# pages and pages where the locate pass finds no result labels, 'always' about
+# every page and 'never' skips it. GEOMETRY_DESKEW=0 disables the deskew.
+GEOMETRY_DESKEW = os.getenv('GEOMETRY_DESKEW', '1') != '0'
+GEOMETRY_ORIENTATION = os.getenv('GEOMETRY_ORIENTATION', 'auto')
+GEOMETRY_WIDTH = int(os.getenv('GEOMETRY_WIDTH') or 1000)
+ORIENTATION_MIN_CONFIDENCE = 2.0  # Less confident detections leave the page as it is
+
+# Known layouts: pages matching a layout of the registry at LAYOUTS_PATH (see
+# layouts.py) only get that layout's OCR attempt on its result region, and go
+# through the generic pipeline when it doesn't yield the fields. A match needs
+# the perceptual hashes within LAYOUT_MAX_DISTANCE bits (of 64); photos of
+# the same layout differ by up to ~18, and a wrong match only costs one attempt.
+LAYOUTS_ENABLED = os.getenv('LAYOUTS_ENABLED', '1') != '0'
+LAYOUTS_PATH = os.getenv('LAYOUTS_PATH', 'layouts.json')
+LAYOUT_MAX_DISTANCE = int(os.getenv('LAYOUT_MAX_DISTANCE') or 18)
+
+# Region of interest: a coarse word-level pass over a downscaled copy of the
+# page (ROI_LAYOUT_WIDTH pixels wide) locates the result labels, and the full
+# OCR attempt matrix then only runs on a horizontal band around them. Pages
+# without labels, or whose band yields no fields, fall back to the full page.
+ROI_ENABLED = os.getenv('ROI_ENABLED', '1') != '0'
+ROI_LAYOUT_WIDTH = int(os.getenv('ROI_LAYOUT_WIDTH') or 1200)
+ROI_LAYOUT_CONFIG = '--psm 11'
+ROI_ANCHOR_WORDS = {'SPI', 'CPI', 'SGPA', 'CGPA', 'PERFORMANCE', 'PERCENTAGE', 'PERCENT'}
+ROI_PERCENT_PATTERN = re.compile(r'^\d{1,3}(?:\.\d+)?%$')
+ROI_MAX_FRACTION = 0.6  # Bands taller than this share of the page aren't worth cropping
+
+# OCR mode: 'parallel' runs every attempt at once, 'cascade' runs them in
+# OCR_CASCADE_ORDER (OCR_CASCADE_BATCH at a time) and stops early once the
+# extracted fields satisfy OCR_STOP_POLICY:
+#   'complete' - all required fields found and consistent (SPI != CPI)
+#   'any'      - at least one field found
+#   'never'    - run the whole order
+OCR_MODE = os.getenv('OCR_MODE', 'parallel')
+# Cheapest first: 'original_gray' needs no denoising, and the slow page
+# segmentation modes (psm 3/11) come late. Every variant is built at the
+# normalized text height; the 'scaled_*' ones only sharpen (and equalize) it
+DEFAULT_CASCADE_ORDER = [
+    'original_gray', 'enhanced_psm6', 'enhanced_psm4', 'scaled_enhanced',
+    'enhanced_psm6_whitelist', 'thresh_gaussian', 'enhanced_psm3', 'enhanced_psm11',
+    'scaled_sharp', 'denoised', 'dilated', 'original'
+]
+OCR_CASCADE_ORDER = [name.strip() for name in os.getenv('OCR_CASCADE_ORDER', '').split(',') if name.strip()] \
+    or DEFAULT_CASCADE_ORDER
+OCR_CASCADE_BATCH = int(os.getenv('OCR_CASCADE_BATCH') or 1)
+OCR_STOP_POLICY = os.getenv('OCR_STOP_POLICY', 'complete')
+
+# Consensus: every attempt is extracted on its own and the attempts vote on
+# each field, weighted by tesseract's confidence in the value word and by the
+# attempt's weight. OCR_ATTEMPT_WEIGHTS is a JSON object of relative accuracy
+# per attempt name (default 1.0), e.g. '{"original": 0.5, "scaled_enhanced": 1.5}'.
+# In parallel mode the remaining attempts are cancelled once every field has
+# OCR_AGREEMENT_MIN_VOTES agreeing attempts holding OCR_AGREEMENT_THRESHOLD of its vote.
+OCR_ATTEMPT_WEIGHTS = {name: 1.0 for name in OCR_ATTEMPTS}
+OCR_ATTEMPT_WEIGHTS.update(json.loads(os.getenv('OCR_ATTEMPT_WEIGHTS') or '{}'))
+OCR_AGREEMENT_THRESHOLD = float(os.getenv('OCR_AGREEMENT_THRESHOLD') or 0.75)
+OCR_AGREEMENT_MIN_VOTES = int(os.getenv('OCR_AGREEMENT_MIN_VOTES') or 3)
+VOTE_FIELDS = {'college': ['spi', 'cpi'], 'school': ['percentage_10th', 'percentage_12th']}
+# Label words of each field when reading values by position; a school
+# percentage whose label line names its exam (the qualifiers of extraction.py,
+# left of the label) is that exam's, the others are the 10th and the 12th
+# from the top down
+FIELD_LABELS = {
+    'college': {'spi': {'SPI', 'SGPA'}, 'cpi': {'CPI', 'CGPA'}},
+    'school': {'percentage': {'PERCENTAGE', 'PERCENT'}},
+}
+QUALIFIER_WORDS = {field: {word.upper() for word in words} for field, words in PERCENTAGE_QUALIFIERS.items()}
+
+# Numeric fields: once the locate pass has found the result labels, the value
+# cells next to them are cut out, scaled to NUMERIC_TEXT_HEIGHT pixels, stacked
+# into one small image and read in a single digits-and-dot tesseract pass.
+# When every value reads with NUMERIC_MIN_CONFIDENCE the page is done; other
+# pages go on to the full OCR attempts.
+NUMERIC_ENABLED = os.getenv('NUMERIC_ENABLED', '1') != '0'
+NUMERIC_TEXT_HEIGHT = int(os.getenv('NUMERIC_TEXT_HEIGHT') or 32)
+NUMERIC_MIN_CONFIDENCE = float(os.getenv('NUMERIC_MIN_CONFIDENCE') or 80)
+NUMERIC_CONFIG = '--psm 6 -c tessedit_char_whitelist=0123456789.%'
+NUMERIC_CELL_PATTERN = re.compile(r'\d')
+
+# Type classification: before the OCR attempts fan out, the words of the
+# locate pass (or, without it, a quick pass over the top CLASSIFY_HEADER_FRACTION
+# of the page) decide whether the page is a college or school marksheet. With
+# at least CLASSIFY_MIN_CONFIDENCE the page only gets the attempts listed for
+# its type in OCR_ATTEMPTS_COLLEGE / OCR_ATTEMPTS_SCHOOL and is extracted as
+# that type; otherwise every attempt runs and they vote on the type.
+CLASSIFY_ENABLED = os.getenv('CLASSIFY_ENABLED', '1') != '0'
+CLASSIFY_MIN_CONFIDENCE = float(os.getenv('CLASSIFY_MIN_CONFIDENCE') or 0.6)
+CLASSIFY_HEADER_FRACTION = 0.25
+# GPA tables read best with the row-preserving modes; the page layout and
+# sparse modes (psm 3/11) split label and value apart. Percentages often sit in
+# running text, which the GPA-tuned whitelist and stroke dilation don't help.
+DEFAULT_TYPE_ATTEMPTS = {
+    'college': [name for name in OCR_ATTEMPTS if name not in ('enhanced_psm3', 'enhanced_psm11', 'original')],
+    'school': [name for name in OCR_ATTEMPTS if name not in ('enhanced_psm6_whitelist', 'dilated', 'original')],
+}
+OCR_ATTEMPTS_COLLEGE = [name.strip() for name in os.getenv('OCR_ATTEMPTS_COLLEGE', '').split(',') if name.strip()] \
+    or DEFAULT_TYPE_ATTEMPTS['college']
+OCR_ATTEMPTS_SCHOOL = [name.strip() for name in os.getenv('OCR_ATTEMPTS_SCHOOL', '').split(',') if name.strip()] \
+    or DEFAULT_TYPE_ATTEMPTS['school']
+
+_unknown_attempts = (set(OCR_CASCADE_ORDER) | set(OCR_ATTEMPT_WEIGHTS) | set(OCR_ATTEMPTS_COLLEGE)
+                     | set(OCR_ATTEMPTS_SCHOOL)) - set(OCR_ATTEMPTS)
+if _unknown_attempts:
+    raise ValueError(f'Unknown OCR attempts in OCR_CASCADE_ORDER/OCR_ATTEMPT_WEIGHTS/OCR_ATTEMPTS_*: {", ".join(sorted(_unknown_attempts))}')
+
+# Bump whenever preprocessing, OCR or extraction changes in a way that would
+# make previously cached results stale
+PIPELINE_VERSION = '7'
+
+# Result cache keyed by upload bytes + pipeline config. Set RESULT_CACHE_PATH
+# to an empty string for a memory-only cache, RESULT_CACHE_ENABLED=0 to disable.
+RESULT_CACHE_ENABLED = os.getenv('RESULT_CACHE_ENABLED', '1') != '0'
+RESULT_CACHE_STORE_TEXT = os.getenv('RESULT_CACHE_STORE_TEXT', '1') != '0'
+result_cache = ResultCache(
+    os.getenv('RESULT_CACHE_PATH', os.path.join('uploads', 'result_cache.sqlite3')),
+    max_memory_entries=int(os.getenv('RESULT_CACHE_SIZE') or 256),
+    max_disk_entries=int(os.getenv('RESULT_CACHE_DISK_SIZE') or 10000),
+    ttl=int(os.getenv('RESULT_CACHE_TTL') or 7 * 24 * 3600)
+) if RESULT_CACHE_ENABLED else None
+
+layout_registry = LayoutRegistry(LAYOUTS_PATH)
+
+# Per-stage timing: every document's stage timings are logged (INFO, logger
+# 'pipeline') and aggregated into these histograms, exposed by the app at /metrics.
+# The histograms of all worker processes are added up in the SQLite file
+# METRICS_PATH; set it to an empty string to report each process on its own
+logger = logging.getLogger(__name__)
+METRICS_PATH = os.getenv('METRICS_PATH', os.path.join('uploads', 'metrics.sqlite3'))
+metrics_store = MetricsStore(METRICS_PATH) if METRICS_PATH else None
+STAGE_SECONDS = Histogram('marksheet_stage_seconds', 'Time spent in each pipeline stage (step: variant or OCR attempt)',
+                          ['stage', 'step'], store=metrics_store)
+DOCUMENT_SECONDS = Histogram('marksheet_document_seconds', 'Time to process a whole document',
+                             ['kind', 'cache'], store=metrics_store)
+
+_pdf2image = None
+
+def load_pdf2image():
+    """The pdf2image module, imported on first use (only PDF uploads need it)"""
+    global _pdf2image
+    if _pdf2image is None:
+        try:
+            import pdf2image as module
+        except ImportError:
+            raise RuntimeError('pdf2image is not installed. Install it and try again.')
+        _pdf2image = module
+    return _pdf2image
+
+class PdfDocument:
+    """A PDF given as bytes, opened with poppler.
+    
+    poppler needs a file, so while the document is open it lives in a
+    temporary directory (outside UPLOAD_FOLDER) that is removed on close.
+    """
+    
+    def __init__(self, data):
+        self.pdf2image = load_pdf2image()
+        self.data = data
+        self.poppler_kwargs = {'poppler_path': POPPLER_PATH} if POPPLER_PATH else {}
+    
+    def __enter__(self):
+        self._tmp_dir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self._tmp_dir.name, 'document.pdf')
+        with open(self.path, 'wb') as f:
+            f.write(self.data)
+        self.page_count = self.pdf2image.pdfinfo_from_path(self.path, **self.poppler_kwargs)['Pages']
+        return self
+    
+    def __exit__(self, *exc_info):
+        self._tmp_dir.cleanup()
+    
+    def render_page(self, page, dpi=None):
+        """Render one page and return it as a BGR array"""
+        images = self.pdf2image.convert_from_path(self.path, dpi=dpi or PDF_DPI, first_page=page, last_page=page,
+                                                    **self.poppler_kwargs)
+        if not images:
+            raise RuntimeError(f'Could not render PDF page {page}.')
+        return cv2.cvtColor(np.array(images[0].convert('RGB')), cv2.COLOR_RGB2BGR)
+    
+    def page_text(self, page):
+        """Return the embedded text layer of one page, or '' if there is none"""
+        pdftotext = os.path.join(POPPLER_PATH, 'pdftotext') if POPPLER_PATH else 'pdftotext'
+        try:
+            completed = subprocess.run(
+                [pdftotext, '-layout', '-enc', 'UTF-8', '-f', str(page), '-l', str(page), self.path, '-'],
+                capture_output=True, timeout=30
+            )
+        except (OSError, subprocess.TimeoutExpired):
+            return ''
+        if completed.returncode != 0:
+            return ''
+        return completed.stdout.decode('utf-8', errors='replace')
+
+def decode_image(data):
+    """Decode an uploaded image from memory into a BGR array"""
+    img = cv2.imdecode(np.frombuffer(data, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        raise ValueError('Could not read image')
+    return img
+
+def estimate_text_height(gray):
+    """Typical glyph height in pixels, or None when the page has too few glyphs.
+    
+    The median height of the connected components, weighted by their ink so
+    that JPEG specks and watermark fragments don't drag it down.
+    """
+    _, binary = cv2.threshold(gray, 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    _, _, stats, _ = cv2.connectedComponentsWithStats(binary, connectivity=8)
+    heights = stats[1:, cv2.CC_STAT_HEIGHT]
+    widths = stats[1:, cv2.CC_STAT_WIDTH]
+    # Skip table rules and blobs of touching characters
+    glyphs = (heights >= 3) & (heights <= gray.shape[0] // 10) & (widths <= 3 * heights)
+    if np.count_nonzero(glyphs) < TEXT_MIN_GLYPHS:
+        return None
+    heights = heights[glyphs]
+    order = np.argsort(heights)
+    ink = np.cumsum(stats[1:, cv2.CC_STAT_AREA][glyphs][order])
+    return float(heights[order][np.searchsorted(ink, ink[-1] / 2)])
+
+def text_scale(image, text_height=None):
+    """Factor that brings the text of `image` to `text_height` pixels (1.0 when no resize is needed)"""
+    text_height = OCR_TEXT_HEIGHT if text_height is None else text_height
+    if not text_height:
+        return 1.0
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    estimate = estimate_text_height(gray)
+    if estimate is None:
+        return 1.0
+    scale = min(max(text_height / estimate, TEXT_SCALE_LIMITS[0]), TEXT_SCALE_LIMITS[1])
+    return 1.0 if abs(scale - 1.0) < TEXT_SCALE_TOLERANCE else scale
+
+def _resize(image, scale):
+    if scale == 1.0:
+        return image
+    height, width = image.shape[:2]
+    interpolation = cv2.INTER_AREA if scale < 1.0 else cv2.INTER_CUBIC
+    return cv2.resize(image, (round(width * scale), round(height * scale)), interpolation=interpolation)
+
+# Kernels of the variant builders, built once instead of per page
+OPENING_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (2, 2))
+DILATE_KERNEL = cv2.getStructuringElement(cv2.MORPH_RECT, (1, 1))
+SHARPEN_KERNEL = np.array([[-1,-1,-1], [-1,9,-1], [-1,-1,-1]])
+
+# CLAHE objects keep per-call state, so each thread gets its own, reused
+# across pages
+_clahe = threading.local()
+
+def clahe(clip_limit, tile_grid_size):
+    """This thread's CLAHE object for the given settings"""
+    objects = getattr(_clahe, 'objects', None)
+    if objects is None:
+        objects = _clahe.objects = {}
+    key = (clip_limit, tile_grid_size)
+    if key not in objects:
+        objects[key] = cv2.createCLAHE(clipLimit=clip_limit, tileGridSize=tile_grid_size)
+    return objects[key]
+
+def _build_normalized(variants):
+    # 0. Rescale to the text height tesseract reads best
+    return _resize(variants['image'], variants.text_scale())
+
+def _build_reduced_gray(variants):
+    # Grayscale page, only ever downscaled, for the filters too slow to run on upscaled pages
+    if variants.text_scale() <= 1.0:
+        return variants['original_gray']
+    return cv2.cvtColor(variants['image'], cv2.COLOR_BGR2GRAY)
+
+def _build_original(variants):
+    # Normalized upload, in the RGB channel order tesseract expects
+    return cv2.cvtColor(variants['normalized'], cv2.COLOR_BGR2RGB)
+
+def _build_original_gray(variants):
+    return cv2.cvtColor(variants['normalized'], cv2.COLOR_BGR2GRAY)
+
+def estimate_noise(gray):
+    """Standard deviation of the pixel noise, measured on the flat areas of the page"""
+    response = np.abs(cv2.filter2D(gray.astype(np.float32), -1, NOISE_KERNEL))[1:-1, 1:-1]
+    edges = cv2.dilate(cv2.Canny(gray, 100, 200), np.ones((3, 3), np.uint8))[1:-1, 1:-1]
+    flat = response[edges == 0]
+    if not flat.size:
+        return 0.0
+    return float(np.sqrt(np.pi / 2) * flat.mean() / 6)
+
+def choose_denoise(noise, pixels):
+    """The 'auto' denoising strategy for a page with the given noise level and size"""
+    if noise < DENOISE_SKIP_SIGMA:
+        return 'none'
+    if noise < DENOISE_NLMEANS_SIGMA:
+        return 'median'
+    return 'nlmeans' if pixels <= DENOISE_NLMEANS_MAX_PIXELS else 'bilateral'
+
+DENOISERS = {
+    'none': lambda gray: gray,
+    'median': lambda gray: cv2.medianBlur(gray, 3),
+    'bilateral': lambda gray: cv2.bilateralFilter(gray, 5, 50, 50),
+    'nlmeans': cv2.fastNlMeansDenoising,
+}
+
+def _build_denoised(variants):
+    # 1. Noise reduction (see OCR_DENOISE), then up to the normalized size
+    gray = variants['reduced_gray']
+    strategy = variants.denoise
+    if strategy == 'auto':
+        variants.noise = estimate_noise(gray)
+        strategy = choose_denoise(variants.noise, gray.size)
+    variants.denoise_used = strategy
+    return _resize(DENOISERS[strategy](gray), max(variants.text_scale(), 1.0))
+
+def _build_thresh_gaussian(variants):
+    # 2. Adaptive thresholding - works well for table structures
+    return cv2.adaptiveThreshold(variants['denoised'], 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, 
+                                 cv2.THRESH_BINARY, 11, 2)
+
+def _build_thresh_mean(variants):
+    return cv2.adaptiveThreshold(variants['denoised'], 255, cv2.ADAPTIVE_THRESH_MEAN_C, 
+                                 cv2.THRESH_BINARY, 15, 5)
+
+def _build_enhanced(variants):
+    # 3. CLAHE for better contrast
+    return clahe(2.0, (8, 8)).apply(variants['denoised'])
+
+def _build_opening(variants):
+    # 4. Morphological operations to clean up table lines
+    return cv2.morphologyEx(variants['thresh_gaussian'], cv2.MORPH_OPEN, OPENING_KERNEL, iterations=1)
+
+def _build_dilated(variants):
+    # 5. Dilation to make text thicker and more readable
+    return cv2.dilate(variants['opening'], DILATE_KERNEL, iterations=1)
+
+def _build_scaled(variants):
+    # 6. Grayscale page at the normalized text height, for the sharpened variants
+    return variants['original_gray']
+
+def _build_scaled_sharp(variants):
+    # 7. Apply sharpening to make details more visible
+    return cv2.filter2D(variants['scaled'], -1, SHARPEN_KERNEL)
+
+def _build_scaled_enhanced(variants):
+    # 8. Extra CLAHE on scaled image
+    return clahe(3.0, (16, 16)).apply(variants['scaled_sharp'])
+
+# Variant graph: each builder pulls the variants it depends on from the same
+# ImageVariants, so shared intermediates (gray, denoised, scaled) are computed once
+VARIANT_BUILDERS = {
+    'normalized': _build_normalized,
+    'reduced_gray': _build_reduced_gray,
+    'original': _build_original,
+    'original_gray': _build_original_gray,
+    'denoised': _build_denoised,
+    'thresh_gaussian': _build_thresh_gaussian,
+    'thresh_mean': _build_thresh_mean,
+    'enhanced': _build_enhanced,
+    'opening': _build_opening,
+    'dilated': _build_dilated,
+    'scaled': _build_scaled,
+    'scaled_sharp': _build_scaled_sharp,
+    'scaled_enhanced': _build_scaled_enhanced,
+}
+
+class ImageVariants(Mapping):
+    """Preprocessed versions of one image, each computed on first access and memoized.
+    
+    Safe to share between OCR worker threads: concurrent requests for the same
+    variant wait for a single computation. With `record`, the time to build
+    each variant (excluding the variants it was built from) is reported as
+    record('preprocess', seconds, variant).
+    """
+    
+    def __init__(self, image, record=None, text_height=None, denoise=None):
+        self._values = {'image': image}
+        # Target text height of the normalized variants, and the scale that gets there
+        self.text_height = text_height
+        self.scale = None
+        self._scale_lock = threading.Lock()
+        # Denoising strategy setting, the noise level measured for 'auto' and the strategy used
+        self.denoise = denoise or OCR_DENOISE
+        self.noise = None
+        self.denoise_used = None
+        self._locks = {name: threading.Lock() for name in VARIANT_BUILDERS}
+        self._record = record
+        # Time spent building nested variants, per thread
+        self._nested = threading.local()
+    
+    def __getitem__(self, name):
+        if name in self._values:
+            return self._values[name]
+        if name not in VARIANT_BUILDERS:
+            raise KeyError(name)
+        with self._locks[name]:
+            if name not in self._values:
+                self._values[name] = self._build(name)
+        return self._values[name]
+    
+    def _build(self, name):
+        outer = getattr(self._nested, 'seconds', 0.0)
+        self._nested.seconds = 0.0
+        start = time.perf_counter()
+        value = VARIANT_BUILDERS[name](self)
+        elapsed = time.perf_counter() - start
+        if self._record is not None:
+            self._record('preprocess', elapsed - self._nested.seconds, name)
+        self._nested.seconds = outer + elapsed
+        return value
+    
+    def __contains__(self, name):
+        return name == 'image' or name in VARIANT_BUILDERS
+    
+    def __iter__(self):
+        return iter(['image', *VARIANT_BUILDERS])
+    
+    def __len__(self):
+        return len(VARIANT_BUILDERS) + 1
+    
+    def text_scale(self):
+        """Scale from the input page to the normalized variants, estimated once"""
+        with self._scale_lock:
+            if self.scale is None:
+                self.scale = text_scale(self._values['image'], self.text_height)
+        return self.scale
+    
+    def computed(self):
+        """Names of the variants built so far"""
+        return [name for name in self._values if name != 'image']
+    
+    def diagnostics(self):
+        """How the page was preprocessed, as far as it has been"""
+        diagnostics = {}
+        if self.scale is not None:
+            diagnostics['scale'] = round(self.scale, 3)
+        if self.noise is not None:
+            diagnostics['noise'] = round(self.noise, 2)
+        if self.denoise_used is not None:
+            diagnostics['denoise'] = self.denoise_used
+        return diagnostics
+
+def preprocess_image(image, record=None, text_height=None, denoise=None):
+    """Enhanced preprocessing for various types of marksheets.
+    
+    Takes a decoded BGR array (or an image path) and returns an ImageVariants
+    mapping; variants are only computed when OCR asks for them. All of them
+    are built from the page rescaled to `text_height` (OCR_TEXT_HEIGHT by
+    default); OCR word boxes are still reported in input pixels. `denoise`
+    overrides the OCR_DENOISE strategy.
+    """
+    img = cv2.imread(image) if isinstance(image, str) else image
+    if img is None:
+        raise ValueError('Could not read image')
+    
+    return ImageVariants(img, record, text_height, denoise)
+
+def ocr_words(image, config='', attempt=0, page_width=None, record=None):
+    """Run a single word-level tesseract pass while holding one of the global OCR slots.
+    
+    `image` may be a callable, in which case it is loaded (or preprocessed) in
+    the worker before an OCR slot is taken. Returns OcrWords tagged with
+    `attempt`, with boxes scaled back to a page `page_width` pixels wide.
+    `record` gets the time spent waiting for a slot ('ocr_wait') and in
+    tesseract ('ocr'), with the attempt name.
+    """
+    if callable(image):
+        image = image()
+    width = image.shape[1] if isinstance(image, np.ndarray) else image.size[0]
+    start = time.perf_counter()
+    with ocr_slots:
+        started = time.perf_counter()
+        data = get_ocr_backend().image_to_data(image, config=config)
+    if record is not None:
+        record('ocr_wait', started - start, OCR_ATTEMPT_NAMES[attempt])
+        record('ocr', time.perf_counter() - started, OCR_ATTEMPT_NAMES[attempt])
+    return OcrWords.from_data(data, attempt, scale=width / (page_width or width))
+
+def ocr_data(image, config=''):
+    """Run a single word-level tesseract pass while holding one of the global OCR slots"""
+    with ocr_slots:
+        return get_ocr_backend().image_to_data(image, config=config)
+
+# Cleared when tesseract turns out to have no orientation detection
+_osd_available = True
+
+def detect_orientation(gray):
+    """Clockwise rotation (0, 90, 180 or 270 degrees) that turns a grayscale page upright.
+    
+    Returns 0 when tesseract isn't confident, and for every page once
+    orientation detection turned out to be unavailable.
+    """
+    global _osd_available
+    if not _osd_available:
+        return 0
+    try:
+        with ocr_slots:
+            osd = pytesseract.image_to_osd(gray, config='--psm 0', output_type=pytesseract.Output.DICT)
+    except (pytesseract.TesseractError, pytesseract.TesseractNotFoundError) as e:
+        # Pages with too little text fail too; only missing OSD data disables it
+        if isinstance(e, pytesseract.TesseractNotFoundError) or 'osd' in str(e).lower():
+            _osd_available = False
+            logger.warning('Orientation detection unavailable, pages will not be rotated: %s', e)
+        return 0
+    if float(osd.get('orientation_conf', 0)) < ORIENTATION_MIN_CONFIDENCE:
+        return 0
+    return int(osd['rotate']) % 360
+
+def run_layout_pass(image, layout_width=None):
+    """Quick word-level OCR of a copy of the page downscaled to `layout_width`; returns (data, scale)"""
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    height, width = gray.shape
+    scale = min(1.0, (layout_width or ROI_LAYOUT_WIDTH) / width)
+    small = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) \
+        if scale < 1.0 else gray
+    return ocr_data(small, ROI_LAYOUT_CONFIG), scale
+
+def layout_pass_text(layout_pass):
+    """The confidently read words of a layout pass, as text"""
+    data, _ = layout_pass
+    return ' '.join(text.strip() for text, conf in zip(data['text'], data['conf'])
+                    if text.strip() and float(conf) >= 30)
+
+def locate_result_region(image, layout_width=None, layout_pass=None):
+    """Find the band of the page holding the SPI/CPI/percentage results.
+    
+    Returns (top, bottom) row bounds in page pixels, or None when no result
+    labels are found or the band would cover most of the page. `layout_pass`
+    is the page's run_layout_pass() output, when it was already run.
+    """
+    data, scale = layout_pass or run_layout_pass(image, layout_width)
+    page_height = int(image.shape[0] * scale)
+    anchors = []
+    for text, top, box_height, conf in zip(data['text'], data['top'], data['height'], data['conf']):
+        word = text.strip().strip(':.,').upper()
+        if conf >= 30 and (word in ROI_ANCHOR_WORDS or ROI_PERCENT_PATTERN.match(word)):
+            anchors.append((top, top + box_height, box_height))
+    if not anchors:
+        return None
+    
+    # Labels head the result table, so keep a few text lines above them and
+    # more below where the values are
+    line_height = float(np.median([anchor[2] for anchor in anchors]))
+    top = max(0, min(anchor[0] for anchor in anchors) - 3 * line_height)
+    bottom = min(page_height, max(anchor[1] for anchor in anchors) + 8 * line_height)
+    if bottom - top > ROI_MAX_FRACTION * page_height:
+        return None
+    
+    return int(top / scale), int(bottom / scale)
+
+def find_value_cells(layout_pass, marksheet_type=None):
+    """Boxes of the values next to the result labels found by a layout pass.
+    
+    Returns (marksheet_type, {field: [left, top, width, height]}) in page
+    pixels, the type following the labels when not given. Values are the words
+    with digits right of a label or below it (see find_labeled_values), mapped
+    to fields like the word-position pass of the OCR attempts does (FIELD_LABELS
+    and assign_percentages), so both read the same value into the same field.
+    """
+    data, scale = layout_pass
+    words = OcrWords.from_data(data, scale=scale)
+    is_number = lambda text: bool(NUMERIC_CELL_PATTERN.search(text)) and len(text) <= 8
+    
+    cells = {}
+    for candidate_type in [marksheet_type] if marksheet_type else ['college', 'school']:
+        for field, labels in FIELD_LABELS[candidate_type].items():
+            pairs = find_labeled_values(words, labels, is_number)
+            if not pairs:
+                continue
+            if field == 'percentage':
+                cells.update((name, words.box(i)) for name, i in assign_percentages(words, pairs).items())
+            else:
+                cells[field] = words.box(max((value for value, _ in pairs), key=lambda i: words.conf[i]))
+        if cells:
+            return candidate_type, cells
+    return marksheet_type, cells
+
+def read_numeric_fields(image, cells, text_height=None):
+    """Read value cells with one digit-only OCR pass over the cells stacked together.
+    
+    Returns {field: [(text, confidence), ...]} with the words of each cell
+    that read as anything, left to right.
+    """
+    text_height = text_height or NUMERIC_TEXT_HEIGHT
+    gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+    page_height, page_width = gray.shape
+    
+    # Each cell padded by its text height, scaled to the target text height
+    strips = []
+    for field, (left, top, width, height) in cells.items():
+        pad = max(height, 4)
+        crop = gray[max(0, top - pad // 2):min(page_height, top + height + pad // 2),
+                    max(0, left - pad):min(page_width, left + width + pad)]
+        if crop.size:
+            strips.append((field, _resize(crop, text_height / max(height, 1))))
+    if not strips:
+        return {}
+    
+    # One strip per row with a blank row of text height in between
+    gap = text_height
+    canvas = np.full((sum(strip.shape[0] + gap for _, strip in strips) + gap,
+                      max(strip.shape[1] for _, strip in strips) + 2 * gap), 255, dtype=np.uint8)
+    rows = []
+    y = gap
+    for field, strip in strips:
+        canvas[y:y + strip.shape[0], gap:gap + strip.shape[1]] = strip
+        rows.append((field, y, y + strip.shape[0]))
+        y += strip.shape[0] + gap
+    
+    words = OcrWords.from_data(ocr_data(canvas, NUMERIC_CONFIG))
+    center = words.top + words.height / 2
+    fields = {}
+    for field, row_top, row_bottom in rows:
+        in_row = np.flatnonzero((center >= row_top) & (center < row_bottom))
+        if len(in_row):
+            in_row = in_row[np.argsort(words.left[in_row])]
+            fields[field] = [(words.text[i], float(words.conf[i])) for i in in_row]
+    return fields
+
+def build_ocr_attempts(processed_images, names=None):
+    """Build the (attempt id, image, config) list for the named OCR attempts (all of them by default).
+    
+    The attempt id is the attempt's position in OCR_ATTEMPTS, so words keep the
+    same id whichever mode ran them.
+    """
+    attempt_ids = {name: i for i, name in enumerate(OCR_ATTEMPT_NAMES)}
+    attempts = []
+    for name in names if names is not None else OCR_ATTEMPTS:
+        variant, config = OCR_ATTEMPTS[name]
+        # Images are built lazily so preprocessing runs in the OCR workers
+        if variant in processed_images:
+            attempts.append((attempt_ids[name], partial(processed_images.__getitem__, variant), config))
+    
+    return attempts
+
+def ocr_attempt(image, config='', attempt=0, page_width=None, record=None, marksheet_type=None):
+    """OCR one attempt and extract its fields on their own (as `marksheet_type` if given); returns (words, result)"""
+    words = ocr_words(image, config, attempt, page_width, record)
+    start = time.perf_counter()
+    result = extract_marksheet_data(words.to_text(), words, marksheet_type)
+    if record is not None:
+        record('extract', time.perf_counter() - start, OCR_ATTEMPT_NAMES[attempt])
+    return words, result
+
+def run_ocr_attempts(attempts, page_width=None, stop=None, record=None, marksheet_type=None):
+    """Fan OCR attempts out over the shared pool.
+    
+    Returns the (words, result) pairs of the attempts that read any text, in
+    attempt order, the number of attempts whose result was collected and the
+    number that failed (raised; they are logged and left out of the results).
+    `stop` is called with the pairs collected so far as attempts finish; once
+    it returns True the attempts that haven't started yet are cancelled, and
+    those already running finish without being waited for or counted. With
+    `marksheet_type` every attempt is extracted as that type instead of
+    detecting it.
+    """
+    futures = {ocr_executor.submit(ocr_attempt, image, config, attempt, page_width, record, marksheet_type): position
+               for position, (attempt, image, config) in enumerate(attempts)}
+    
+    ocr_results = {}
+    completed = errors = 0
+    for future in as_completed(futures):
+        try:
+            words, result = future.result()
+        except Exception:
+            errors += 1
+            logger.warning('OCR attempt %s failed', OCR_ATTEMPT_NAMES[attempts[futures[future]][0]], exc_info=True)
+            continue
+        completed += 1
+        if len(words):
+            ocr_results[futures[future]] = (words, result)
+            if stop is not None and stop([ocr_results[position] for position in sorted(ocr_results)]):
+                for pending in futures:
+                    pending.cancel()
+                break
+    
+    return [ocr_results[position] for position in sorted(ocr_results)], completed, errors
+
+def _is_gpa(text):
+    if not GPA_WORD_PATTERN.match(text):
+        return False
+    return 0 < float(text) <= 10
+
+def _is_percentage(text):
+    match = PERCENT_WORD_PATTERN.match(text)
+    return bool(match) and 0 <= float(match.group(1)) <= 100
+
+def _field_value(field, text):
+    """Format a value word the way the text extractors report the field"""
+    if field.startswith('percentage'):
+        return f"{float(PERCENT_WORD_PATTERN.match(text).group(1)):.2f}"
+    return text
+
+def _value_word(words, field, value):
+    """Index of the most confident word reading as `value`, or None"""
+    is_value = _is_percentage if field.startswith('percentage') else _is_gpa
+    matches = [i for i, text in enumerate(words.text)
+               if is_value(text) and float(_field_value(field, text)) == float(value)]
+    return max(matches, key=lambda i: words.conf[i]) if matches else None
+
+def assign_percentages(words, pairs):
+    """Assign labeled school percentages to percentage_10th and percentage_12th.
+    
+    `pairs` are (value, label) index pairs from find_labeled_values, all of
+    one attempt. A value whose label line names its exam (see QUALIFIER_WORDS)
+    gets that field; the rest fill the remaining fields from the top of the
+    page down. Returns {field: value index}.
+    """
+    normalized = normalize_words(words)
+    labels = {}
+    for value, label in pairs:
+        labels.setdefault(value, label)
+    
+    assigned = {}
+    unqualified = []
+    for value in sorted(labels, key=lambda i: (words.top[i], words.left[i])):
+        label = labels[value]
+        # The nearest qualifier left of the label on its line
+        left_of = np.flatnonzero((words.attempt == words.attempt[label]) & (words.line == words.line[label])
+                                 & (words.left < words.left[label]))
+        field = None
+        for i in left_of[np.argsort(-words.left[left_of])]:
+            field = next((name for name, qualifiers in QUALIFIER_WORDS.items()
+                          if normalized[i] in qualifiers), None)
+            if field:
+                break
+        if field and field not in assigned:
+            assigned[field] = value
+        else:
+            unqualified.append(value)
+    
+    remaining = [field for field in QUALIFIER_WORDS if field not in assigned]
+    assigned.update(zip(remaining, unqualified))
+    return assigned
+
+def apply_word_positions(result, words):
+    """Refine text-extracted fields with the word boxes of the OCR attempts.
+    
+    Each field's value is looked up next to its label (right of it on the same
+    row, or below it in the same column; school percentages are assigned to
+    10th and 12th by assign_percentages). Of the attempts that found a field,
+    the most confident one wins over the text match. Every field that has a
+    value gets its [left, top, width, height] box in result['boxes'].
+    """
+    candidates = {}
+    if result['marksheet_type'] == 'college':
+        for field, labels in FIELD_LABELS['college'].items():
+            pairs = find_labeled_values(words, labels, _is_gpa)
+            candidates[field] = [value for value, _ in pairs]
+    else:
+        pairs = find_labeled_values(words, FIELD_LABELS['school']['percentage'], _is_percentage)
+        for attempt in sorted({int(words.attempt[value]) for value, _ in pairs}):
+            assigned = assign_percentages(words, [pair for pair in pairs if words.attempt[pair[0]] == attempt])
+            for field, value in assigned.items():
+                candidates.setdefault(field, []).append(value)
+    
+    boxes = {}
+    for field, values in candidates.items():
+        if values:
+            # Most confident value first, earlier attempts breaking ties
+            index = min(values, key=lambda i: (-words.conf[i], words.attempt[i]))
+            result[field] = _field_value(field, words.text[index])
+            boxes[field] = words.box(index)
+    
+    # Fields only the text extractor found: box the most confident matching word
+    for field in ('spi', 'cpi', 'percentage_10th', 'percentage_12th'):
+        value = result.get(field)
+        if not value or field in boxes:
+            continue
+        index = _value_word(words, field, value)
+        if index is not None:
+            boxes[field] = words.box(index)
+    
+    if boxes:
+        result['boxes'] = boxes
+    return result
+
+def extract_marksheet_data(text, words=None, marksheet_type=None):
+    """Detect the marksheet type (unless given) and run the matching extractor.
+    
+    With `words` (OcrWords of the same OCR attempts) the fields are refined by
+    label position and get bounding boxes, see apply_word_positions.
+    """
+    marksheet_type = marksheet_type or detect_marksheet_type(text)
+    
+    if marksheet_type == 'college':
+        result = extract_college_marksheet_data(text)
+    else:
+        result = extract_school_marksheet_data(text)
+    result['marksheet_type'] = marksheet_type
+    
+    if words is not None and len(words):
+        apply_word_positions(result, words)
+    
+    return result
+
+def _mean_confidence(words):
+    """Mean tesseract confidence of an attempt's words, 0-1"""
+    conf = words.conf[words.conf >= 0]
+    return float(conf.mean()) / 100 if len(conf) else 0.0
+
+def _field_word(words, result, field):
+    """Index of the word an attempt read `field` from: the word at the field's
+    box (its labeled value), else the most confident word reading as the value"""
+    box = result.get('boxes', {}).get(field)
+    if box is not None:
+        at_box = np.flatnonzero((words.left == box[0]) & (words.top == box[1])
+                                & (words.width == box[2]) & (words.height == box[3]))
+        if len(at_box):
+            return int(at_box[0])
+    return _value_word(words, field, result[field])
+
+def vote_on_attempts(ocr_results, weights=None):
+    """Merge per-attempt (words, result) pairs by confidence-weighted voting.
+    
+    Every attempt's result maps labels to fields the same way (see
+    apply_word_positions), so a field's votes all come from the same label.
+    Each attempt votes for the marksheet type with its mean word confidence,
+    and for every field value it extracted with the confidence of the word it
+    read that field from; both are multiplied by the attempt's entry in
+    `weights` (OCR_ATTEMPT_WEIGHTS by default).
+    Returns the merged result, whose 'agreement' maps each field to the
+    winning value's share of the vote, and {field: attempts backing the winner}.
+    """
+    names = list(OCR_ATTEMPTS)
+    weights = OCR_ATTEMPT_WEIGHTS if weights is None else weights
+    weighted = [(words, result, weights.get(names[int(words.attempt[0])], 1.0))
+                for words, result in ocr_results]
+    if not weighted:
+        result = extract_marksheet_data('')
+        result['agreement'] = {}
+        return result, {}
+    
+    type_votes = Counter()
+    for words, result, weight in weighted:
+        type_votes[result['marksheet_type']] += weight * max(_mean_confidence(words), 0.01)
+    marksheet_type = type_votes.most_common(1)[0][0]
+    
+    merged = {'marksheet_type': marksheet_type}
+    agreement, votes, boxes = {}, {}, {}
+    for field in VOTE_FIELDS[marksheet_type]:
+        # float(value) -> [total score, supporting attempts, best single vote]
+        tally = {}
+        for words, result, weight in weighted:
+            value = result.get(field)
+            if result['marksheet_type'] != marksheet_type or not value:
+                continue
+            index = _field_word(words, result, field)
+            confidence = float(words.conf[index]) / 100 if index is not None else _mean_confidence(words)
+            score = weight * max(confidence, 0.01)
+            entry = tally.setdefault(float(value), [0.0, 0, None])
+            entry[0] += score
+            entry[1] += 1
+            if entry[2] is None or score > entry[2][0]:
+                entry[2] = (score, value, result.get('boxes', {}).get(field))
+        
+        if not tally:
+            merged[field] = None
+            continue
+        # Ties go to the value seen first, i.e. from the earlier attempt
+        total, supporters, (_, value, box) = max(tally.values(), key=lambda entry: entry[0])
+        merged[field] = value
+        agreement[field] = round(total / sum(entry[0] for entry in tally.values()), 3)
+        votes[field] = supporters
+        if box is not None:
+            boxes[field] = box
+    
+    merged['raw_text'] = OCR_ATTEMPT_SEPARATOR.join(words.to_text() for words, _, _ in weighted)
+    merged['agreement'] = agreement
+    if boxes:
+        merged['boxes'] = boxes
+    return merged, votes
+
+def has_consensus(result, votes, threshold=None, min_votes=None):
+    """True when every field the page needs has a winner backed by at least
+    `min_votes` attempts and `threshold` of the vote (OCR_AGREEMENT_MIN_VOTES
+    and OCR_AGREEMENT_THRESHOLD by default)"""
+    threshold = OCR_AGREEMENT_THRESHOLD if threshold is None else threshold
+    min_votes = OCR_AGREEMENT_MIN_VOTES if min_votes is None else min_votes
+    required = ['spi', 'cpi'] if result['marksheet_type'] == 'college' else ['percentage_10th']
+    return all(result['agreement'].get(field, 0) >= threshold
+               and votes.get(field, 0) >= min_votes for field in required)
+
+def is_extraction_complete(result, policy=None):
+    """Check extracted fields against a cascade stop policy"""
+    policy = policy or OCR_STOP_POLICY
+    if policy == 'never':
+        return False
+    
+    if result['marksheet_type'] == 'college':
+        fields = [result.get('spi'), result.get('cpi')]
+        if policy == 'complete':
+            # SPI == CPI usually means the same number was matched twice
+            return all(fields) and fields[0] != fields[1]
+    else:
+        # School marksheets normally carry a single percentage
+        fields = [result.get('percentage_10th'), result.get('percentage_12th')]
+    
+    return any(fields)
+
+def run_ocr_cascade(processed_images, order=None, policy=None, batch_size=None, weights=None, record=None,
+                    marksheet_type=None):
+    """Run OCR attempts in priority order, extracting after each batch and
+    stopping as soon as the stop policy is satisfied"""
+    order = order if order is not None else OCR_CASCADE_ORDER
+    batch_size = batch_size or OCR_CASCADE_BATCH
+    page_width = processed_images['image'].shape[1]
+    
+    ocr_results = []
+    result = None
+    attempts_used = errors = 0
+    
+    for start in range(0, len(order), batch_size):
+        names = order[start:start + batch_size]
+        batch_results, attempts_run, batch_errors = run_ocr_attempts(
+            build_ocr_attempts(processed_images, names), page_width, record=record, marksheet_type=marksheet_type)
+        ocr_results.extend(batch_results)
+        attempts_used += attempts_run
+        errors += batch_errors
+        
+        if not ocr_results:
+            continue
+        
+        result, _ = vote_on_attempts(ocr_results, weights)
+        if is_extraction_complete(result, policy):
+            break
+    
+    if result is None:
+        result, _ = vote_on_attempts([])
+    result['ocr_attempts'] = attempts_used
+    result['ocr_errors'] = errors
+    
+    return result
+
+def _collect_page(page, future):
+    try:
+        result = future.result()
+    except Exception as e:
+        return {'page': page, 'error': str(e)}
+    result.update({'page': page, 'source': 'ocr'})
+    return result
+
+def aggregate_page_results(page_results):
+    """Combine per-page results into a document result with a 'pages' list.
+    
+    The document type is the most common page type. For college marksheets the
+    SPI/CPI come from the last page that has them (the latest semester, and the
+    most recent cumulative value); for school marksheets the first percentage found wins.
+    """
+    pages = [result for result in page_results if 'error' not in result]
+    if not pages:
+        raise RuntimeError(page_results[0]['error'] if page_results else 'PDF has no pages.')
+    
+    marksheet_type = Counter(result['marksheet_type'] for result in pages).most_common(1)[0][0]
+    if marksheet_type == 'college':
+        fields = ['spi', 'cpi']
+        ordered = reversed(pages)
+    else:
+        fields = ['percentage_10th', 'percentage_12th']
+        ordered = pages
+    
+    result = {field: None for field in fields}
+    for page_result in ordered:
+        for field in fields:
+            if result[field] is None and page_result['marksheet_type'] == marksheet_type:
+                result[field] = page_result.get(field)
+    
+    result.update({
+        'marksheet_type': marksheet_type,
+        'ocr_attempts': sum(page_result['ocr_attempts'] for page_result in pages),
+        'raw_text': '\n\n'.join(f"--- PAGE {page_result['page']} ---\n\n{page_result['raw_text']}"
+                                 for page_result in pages),
+        # Only when every page was read cleanly (see extract_page)
+        'cacheable': all(page_result.get('cacheable', 'error' not in page_result) for page_result in page_results),
+        'pages': [{key: value for key, value in page_result.items() if key not in ('raw_text', 'cacheable')}
+                  for page_result in page_results]
+    })
+    
+    return result
+
+def to_api_result(result):
+    """Build the JSON API payload for an extraction result (without raw_text)"""
+    api_result = {
+        'marksheet_type': result['marksheet_type'],
+        'ocr_attempts': result['ocr_attempts'],
+        'cache': result['cache'],
+        'success': True
+    }
+    if 'pages' in result:
+        api_result['pages'] = result['pages']
+    if 'boxes' in result:
+        api_result['boxes'] = result['boxes']
+    if 'agreement' in result:
+        api_result['agreement'] = result['agreement']
+    if 'diagnostics' in result:
+        api_result['diagnostics'] = result['diagnostics']
+    
+    if result['marksheet_type'] == 'college':
+        api_result.update({
+            'spi': result.get('spi'),
+            'cpi': result.get('cpi')
+        })
+    else:
+        api_result.update({
+            'percentage_10th': result.get('percentage_10th'),
+            'percentage_12th': result.get('percentage_12th')
+        })
+    
+    return api_result
+
+
+# Settings of each stage, from the environment configuration above. A
+# MarksheetPipeline can override any of them.
+DEFAULT_STAGE_CONFIG = {
+    'pdf': {'dpi': PDF_DPI, 'max_pages': PDF_MAX_PAGES, 'text_layer': PDF_TEXT_LAYER,
+            'page_workers': PDF_PAGE_WORKERS},
+    'geometry': {'deskew': GEOMETRY_DESKEW, 'orientation': GEOMETRY_ORIENTATION, 'width': GEOMETRY_WIDTH},
+    'layout': {'enabled': LAYOUTS_ENABLED, 'max_distance': LAYOUT_MAX_DISTANCE},
+    'locate': {'enabled': ROI_ENABLED, 'layout_width': ROI_LAYOUT_WIDTH},
+    'preprocess': {'text_height': OCR_TEXT_HEIGHT, 'denoise': OCR_DENOISE},
+    'classify': {'enabled': CLASSIFY_ENABLED, 'min_confidence': CLASSIFY_MIN_CONFIDENCE,
+                 'college_attempts': OCR_ATTEMPTS_COLLEGE, 'school_attempts': OCR_ATTEMPTS_SCHOOL},
+    'numeric': {'enabled': NUMERIC_ENABLED, 'text_height': NUMERIC_TEXT_HEIGHT,
+                'min_confidence': NUMERIC_MIN_CONFIDENCE},
+    'ocr': {'mode': OCR_MODE, 'attempts': list(OCR_ATTEMPTS), 'cascade_order': OCR_CASCADE_ORDER,
+            'cascade_batch': OCR_CASCADE_BATCH, 'stop_policy': OCR_STOP_POLICY},
+    'vote': {'weights': OCR_ATTEMPT_WEIGHTS, 'agreement_threshold': OCR_AGREEMENT_THRESHOLD,
+             'agreement_min_votes': OCR_AGREEMENT_MIN_VOTES},
+    'cache': {'enabled': RESULT_CACHE_ENABLED, 'store_text': RESULT_CACHE_STORE_TEXT}
+}
+
+class MarksheetPipeline:
+    """Extract marksheet fields from documents, stage by stage.
+    
+    `config` overrides DEFAULT_STAGE_CONFIG per stage, for example
+    {'ocr': {'mode': 'cascade'}, 'locate': {'enabled': False}}. Every hook is
+    called as hook(stage, seconds, output) after each stage; PDF pages run on
+    the page pool, so hooks must be thread-safe. Results go through `cache`
+    (the shared result_cache by default) unless the cache stage is disabled,
+    and with `save_dir` a copy of every processed document is kept there.
+    Pages are matched against `layouts` (the shared layout_registry by default)
+    unless the layout stage is disabled.
+    
+    Finer timings (each preprocessing variant, OCR attempt and extraction) are
+    collected per document in a StageTimings passed down the stages; run()
+    logs them and returns them under the result's 'timings' key.
+    """
+    
+    def __init__(self, config=None, hooks=None, cache=None, save_dir=None, layouts=None):
+        self.config = {stage: dict(options) for stage, options in DEFAULT_STAGE_CONFIG.items()}
+        for stage, options in (config or {}).items():
+            if stage not in self.config:
+                raise ValueError(f'Unknown pipeline stage: {stage}')
+            unknown = set(options) - set(self.config[stage])
+            if unknown:
+                raise ValueError(f'Unknown {stage} settings: {", ".join(sorted(unknown))}')
+            self.config[stage].update(options)
+        
+        ocr = self.config['ocr']
+        classify = self.config['classify']
+        unknown = (set(ocr['attempts']) | set(ocr['cascade_order']) | set(classify['college_attempts'])
+                   | set(classify['school_attempts'])) - set(OCR_ATTEMPTS)
+        if unknown:
+            raise ValueError(f'Unknown OCR attempts: {", ".join(sorted(unknown))}')
+        if self.config['preprocess']['denoise'] not in ('auto', *DENOISERS):
+            raise ValueError(f'Unknown denoising strategy: {self.config["preprocess"]["denoise"]}')
+        if self.config['geometry']['orientation'] not in ('auto', 'always', 'never'):
+            raise ValueError(f'Unknown orientation mode: {self.config["geometry"]["orientation"]}')
+        
+        self.hooks = list(hooks or [])
+        self.cache = (cache or result_cache) if self.config['cache']['enabled'] else None
+        self.save_dir = save_dir
+        self.layouts = (layout_registry if layouts is None else layouts) if self.config['layout']['enabled'] else None
+    
+    def add_hook(self, hook):
+        self.hooks.append(hook)
+    
+    def _stage(self, name, func, *args, timings=None):
+        start = time.perf_counter()
+        output = func(*args)
+        elapsed = time.perf_counter() - start
+        if timings is not None and name not in ('preprocess', 'ocr'):
+            # Those two are recorded per variant and per attempt
+            timings.record(name, elapsed)
+        for hook in self.hooks:
+            hook(name, elapsed, output)
+        return output
+    
+    def fingerprint(self):
+        """Everything besides the document bytes that affects the extraction result"""
+        config = {stage: options for stage, options in self.config.items() if stage != 'cache'}
+        config['pdf'] = {key: value for key, value in config['pdf'].items() if key != 'page_workers'}
+        if self.layouts is not None:
+            config['layout'] = {**config['layout'], 'registry': self.layouts.fingerprint()}
+        return json.dumps({'version': PIPELINE_VERSION, 'attempts': OCR_ATTEMPTS, **config}, sort_keys=True)
+    
+    # Stages
+    
+    def decode(self, data):
+        return decode_image(data)
+    
+    def geometry(self, image, orientation=False):
+        """PageGeometry straightening a page: its skew, and with `orientation` the rotation turning it upright"""
+        options = self.config['geometry']
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY) if image.ndim == 3 else image
+        height, width = gray.shape
+        scale = min(1.0, options['width'] / width)
+        small = cv2.resize(gray, (int(width * scale), int(height * scale)), interpolation=cv2.INTER_AREA) \
+            if scale < 1.0 else gray
+        
+        rotation = detect_orientation(small) if orientation else 0
+        if rotation:
+            small = cv2.rotate(small, ROTATE_CODES[rotation])
+        skew = estimate_skew(small) if options['deskew'] else 0.0
+        return PageGeometry(rotation, skew)
+    
+    def match_layout(self, image):
+        return self.layouts.match(image, self.config['layout']['max_distance'])
+    
+    def layout_pass(self, image):
+        return run_layout_pass(image, self.config['locate']['layout_width'])
+    
+    def locate(self, image, layout_pass=None):
+        return locate_result_region(image, self.config['locate']['layout_width'], layout_pass)
+    
+    def classify(self, image, layout_pass=None):
+        """College or school, from the page's layout pass or else a quick pass over its header band.
+        
+        Returns {'type', 'confidence', 'applied'}; the type is only applied to
+        the OCR attempts with at least the configured confidence.
+        """
+        if layout_pass is None:
+            header = image[:max(1, int(image.shape[0] * CLASSIFY_HEADER_FRACTION))]
+            layout_pass = run_layout_pass(header, self.config['locate']['layout_width'])
+        marksheet_type, confidence = classify_marksheet_type(layout_pass_text(layout_pass))
+        return {'type': marksheet_type, 'confidence': confidence,
+                'applied': confidence > 0 and confidence >= self.config['classify']['min_confidence']}
+    
+    def preprocess(self, image, timings=None):
+        options = self.config['preprocess']
+        return preprocess_image(image, timings.record if timings else None, options['text_height'], options['denoise'])
+    
+    def read_numeric(self, page, cells, marksheet_type):
+        """Read the value cells found by find_value_cells with the digit-only pass.
+        
+        The cells carry the fields of the labels they were found next to, so
+        the result maps values to fields like the OCR attempts it replaces.
+        Returns a result when every value the page needs reads as a valid
+        number with the configured confidence, otherwise None.
+        """
+        options = self.config['numeric']
+        result = {'marksheet_type': marksheet_type, 'agreement': {}, 'boxes': {}}
+        lines = []
+        for field, cell_words in read_numeric_fields(page, cells, options['text_height']).items():
+            lines.append(f'{field}: ' + ' '.join(text for text, _ in cell_words))
+            is_value = _is_percentage if field.startswith('percentage') else _is_gpa
+            # A word of its own, or the cell's words together when tesseract split the number
+            candidates = cell_words + [(''.join(text for text, _ in cell_words),
+                                        min(confidence for _, confidence in cell_words))]
+            for text, confidence in candidates:
+                if is_value(text) and confidence >= options['min_confidence']:
+                    result[field] = _field_value(field, text)
+                    result['boxes'][field] = cells[field]
+                    break
+        result['raw_text'] = '\n'.join(lines)
+        if not is_extraction_complete(result, 'complete'):
+            return None
+        return result
+    
+    def ocr(self, processed_images, timings=None, marksheet_type=None):
+        """Run the OCR attempts (all at once, or as a cascade) and vote on the fields they found.
+        
+        With a classified `marksheet_type` only the attempts listed for that
+        type run, and their text is extracted as that type. When none of the
+        attempts to run is listed for the type, they all run instead and the
+        result's diagnostics get 'attempts_fallback'.
+        """
+        ocr = self.config['ocr']
+        vote = self.config['vote']
+        record = timings.record if timings else None
+        attempts, order = ocr['attempts'], ocr['cascade_order']
+        fallback = False
+        if marksheet_type:
+            relevant = set(self.config['classify'][f'{marksheet_type}_attempts'])
+            type_attempts = [name for name in attempts if name in relevant]
+            type_order = [name for name in order if name in relevant]
+            # Running no attempt at all would read nothing: keep them all
+            fallback = not (type_order if ocr['mode'] == 'cascade' else type_attempts)
+            if not fallback:
+                attempts, order = type_attempts, type_order
+        if ocr['mode'] == 'cascade':
+            result = run_ocr_cascade(processed_images, order, ocr['stop_policy'],
+                                     ocr['cascade_batch'], vote['weights'], record, marksheet_type)
+            if fallback:
+                result['diagnostics'] = {'attempts_fallback': True}
+            return result
+        
+        # Every attempt at once, until the attempts that finished agree on every field
+        def agreed(results):
+            result, votes = vote_on_attempts(results, vote['weights'])
+            return has_consensus(result, votes, vote['agreement_threshold'], vote['agreement_min_votes'])
+        
+        ocr_results, attempts_run, errors = run_ocr_attempts(build_ocr_attempts(processed_images, attempts),
+                                                             processed_images['image'].shape[1], stop=agreed,
+                                                             record=record, marksheet_type=marksheet_type)
+        
+        result, _ = vote_on_attempts(ocr_results, vote['weights'])
+        result.update({'ocr_attempts': attempts_run, 'ocr_errors': errors})
+        if fallback:
+            result['diagnostics'] = {'attempts_fallback': True}
+        return result
+    
+    # Documents
+    
+    def _ocr_image(self, image, timings=None, marksheet_type=None):
+        processed_images = self._stage('preprocess', self.preprocess, image, timings, timings=timings)
+        result = self._stage('ocr', self.ocr, processed_images, timings, marksheet_type, timings=timings)
+        result['diagnostics'] = {**processed_images.diagnostics(), **result.get('diagnostics', {})}
+        return result
+    
+    def extract_layout(self, page, layout, timings=None):
+        """OCR the region of a known layout with the layout's attempt.
+        
+        The result gets a 'layout' key only when it holds the fields and the
+        layout's anchor words; boxes are in page coordinates either way.
+        """
+        left, top, right, bottom = layout.region_box(page.shape[1], page.shape[0])
+        processed_images = self._stage('preprocess', self.preprocess, page[top:bottom, left:right], timings,
+                                       timings=timings)
+        
+        def read_region():
+            ocr_results, attempts_run, errors = run_ocr_attempts(
+                build_ocr_attempts(processed_images, [layout.attempt]), right - left,
+                record=timings.record if timings else None)
+            result, _ = vote_on_attempts(ocr_results, self.config['vote']['weights'])
+            result.update({'ocr_attempts': attempts_run, 'ocr_errors': errors})
+            return result
+        
+        result = self._stage('ocr', read_region, timings=timings)
+        result['diagnostics'] = processed_images.diagnostics()
+        for box in result.get('boxes', {}).values():
+            box[0] += left
+            box[1] += top
+        if result['marksheet_type'] == layout.marksheet_type and is_extraction_complete(result, 'complete') \
+                and layout.has_anchors(result['raw_text']):
+            result['layout'] = layout.name
+        return result
+    
+    def extract_page(self, image, timings=None):
+        """Straighten, locate, preprocess, OCR and extract a single decoded page.
+        
+        The page is first deskewed and turned upright and every later stage
+        runs on the straightened page; boxes in the result are mapped back to
+        the input image. A page matching a known layout first gets that
+        layout's attempt on its region (see extract_layout). With the locate
+        stage enabled the attempts then run on the result region only; the
+        'region' key of the result holds the band used, in rows of the
+        straightened page. A confidently classified page only gets the
+        attempts relevant to its type (see classify).
+        """
+        height, width = image.shape[:2]
+        orientation = self.config['geometry']['orientation']
+        orientation_checked = orientation == 'always' or (orientation == 'auto' and width > height)
+        geometry = self._stage('geometry', self.geometry, image, orientation_checked, timings=timings)
+        page = geometry.apply(image)
+        
+        result = None
+        attempts_used = errors = 0
+        layout = self._stage('layout', self.match_layout, page, timings=timings) if self.layouts else None
+        if layout is not None:
+            result = self.extract_layout(page, layout, timings)
+            if 'layout' not in result:
+                attempts_used, errors = result['ocr_attempts'], result['ocr_errors']
+                result = None
+        
+        region = layout_pass = None
+        if result is None and self.config['locate']['enabled']:
+            # The layout pass counts as an attempt
+            attempts_used += 1
+            layout_pass = self._stage('layout_pass', self.layout_pass, page, timings=timings)
+            region = self._stage('locate', self.locate, page, layout_pass, timings=timings)
+            if region is None and orientation == 'auto' and not orientation_checked:
+                # No result labels: the page may be upside down or sideways
+                upright = self._stage('geometry', self.geometry, image, True, timings=timings)
+                if upright.rotation:
+                    geometry, page = upright, upright.apply(image)
+                    attempts_used += 1
+                    layout_pass = self._stage('layout_pass', self.layout_pass, page, timings=timings)
+                    region = self._stage('locate', self.locate, page, layout_pass, timings=timings)
+        
+        classification = None
+        if result is None and self.config['classify']['enabled']:
+            # Without a layout pass to reuse, the header pass is an attempt of its own
+            attempts_used += layout_pass is None
+            classification = self._stage('classify', self.classify, page, layout_pass, timings=timings)
+        marksheet_type = classification['type'] if classification and classification['applied'] else None
+        
+        if result is None and layout_pass is not None and self.config['numeric']['enabled']:
+            cells_type, cells = find_value_cells(layout_pass, marksheet_type)
+            if cells:
+                # The numeric pass counts as an attempt
+                attempts_used += 1
+                result = self._stage('numeric', self.read_numeric, page, cells, cells_type, timings=timings)
+                if result is not None:
+                    result.update({'ocr_attempts': attempts_used, 'ocr_errors': errors, 'diagnostics': {'numeric': True}})
+        
+        if result is None and region is not None:
+            top, bottom = region
+            result = self._ocr_image(page[top:bottom], timings, marksheet_type)
+            result['ocr_attempts'] += attempts_used
+            result['ocr_errors'] += errors
+            if is_extraction_complete(result, 'any'):
+                result['region'] = [top, bottom]
+                # Boxes are relative to the band; move them to page coordinates
+                for box in result.get('boxes', {}).values():
+                    box[1] += top
+            else:
+                attempts_used, errors = result['ocr_attempts'], result['ocr_errors']
+                result = None
+        
+        if result is None:
+            result = self._ocr_image(page, timings, marksheet_type)
+            result['ocr_attempts'] += attempts_used
+            result['ocr_errors'] += errors
+        
+        if not geometry.identity and 'boxes' in result:
+            result['boxes'] = {field: geometry.box_to_input(box, width, height)
+                               for field, box in result['boxes'].items()}
+        result['diagnostics'].update(geometry.diagnostics())
+        if result.get('layout'):
+            result['diagnostics']['layout'] = result.pop('layout')
+        if classification is not None:
+            result['diagnostics']['classification'] = classification
+        errors = result.pop('ocr_errors')
+        if errors:
+            result['diagnostics']['ocr_errors'] = errors
+        # A failed attempt or a page without any text may read fine on a retry
+        result['cacheable'] = not errors and bool(result['raw_text'].strip())
+        return result
+    
+    def extract_pdf(self, data, dpi=None, max_pages=None, timings=None):
+        """Extract every page of a PDF and aggregate them into one result.
+        
+        Each page is first tried from its text layer (when enabled). Pages
+        without usable text are rendered one at a time and OCR'd on the page
+        pool, with at most `page_workers` pages rendered but not yet finished
+        at any moment.
+        """
+        options = self.config['pdf']
+        page_results = []
+        in_flight = deque()
+        
+        with PdfDocument(data) as pdf:
+            for page in range(1, min(pdf.page_count, max_pages or options['max_pages']) + 1):
+                if options['text_layer']:
+                    text = self._stage('text_layer', pdf.page_text, page, timings=timings)
+                    if text.strip():
+                        result = extract_marksheet_data(text)
+                        if is_extraction_complete(result, 'any'):
+                            result.update({'page': page, 'source': 'text_layer', 'ocr_attempts': 0})
+                            page_results.append(result)
+                            continue
+                
+                try:
+                    image = self._stage('render', pdf.render_page, page, dpi or options['dpi'], timings=timings)
+                except Exception as e:
+                    page_results.append({'page': page, 'error': str(e)})
+                    continue
+                in_flight.append((page, page_executor.submit(self.extract_page, image, timings)))
+                if len(in_flight) >= options['page_workers']:
+                    page_results.append(_collect_page(*in_flight.popleft()))
+            
+            while in_flight:
+                page_results.append(_collect_page(*in_flight.popleft()))
+        
+        page_results.sort(key=lambda result: result['page'])
+        return self._stage('aggregate', aggregate_page_results, page_results, timings=timings)
+    
+    def run(self, data, filename, dpi=None, max_pages=None):
+        """Run the full pipeline on a document, going through the result cache.
+        
+        PDFs are processed page by page (see extract_pdf); `dpi` and
+        `max_pages` override the pdf stage settings for this document. The
+        returned result has a 'cache' key set to 'hit', 'miss', 'off' or
+        'skipped' (not cached because OCR failed or read nothing), and
+        the stage timings of the document under 'timings' (see StageTimings).
+        """
+        kind = 'pdf' if filename.rsplit('.', 1)[-1].lower() == 'pdf' else 'image'
+        timings = StageTimings(STAGE_SECONDS)
+        status = 'error'
+        try:
+            result = self._run(data, filename, kind, dpi, max_pages, timings)
+            status = result['cache']
+        finally:
+            timings.finish()
+            DOCUMENT_SECONDS.observe(timings.elapsed(), kind, status)
+            if logger.isEnabledFor(logging.INFO):
+                logger.info('timings %s', json.dumps({'file': filename, 'cache': status, **timings.as_dict()}))
+        
+        result['timings'] = timings.as_dict()
+        return result
+    
+    def _run(self, data, filename, kind, dpi, max_pages, timings):
+        cache_key = None
+        if self.cache is not None:
+            cache_key = ResultCache.make_key(data, self.fingerprint(), dpi, max_pages)
+            cached = self._stage('cache', self.cache.get, cache_key, timings=timings)
+            if cached is not None:
+                cached.setdefault('raw_text', '')
+                cached['ocr_attempts'] = 0
+                cached['cache'] = 'hit'
+                return cached
+        
+        if self.save_dir:
+            # Unique prefix so concurrent documents with the same name don't clash
+            file_path = os.path.join(self.save_dir, f'{uuid.uuid4().hex}_{filename}')
+            with open(file_path, 'wb') as f:
+                f.write(data)
+        
+        # Decode the document in memory, then preprocess, OCR and extract data
+        # based on the detected marksheet type
+        if kind == 'pdf':
+            result = self.extract_pdf(data, dpi, max_pages, timings)
+        else:
+            result = self.extract_page(self._stage('decode', self.decode, data, timings=timings), timings)
+        
+        cacheable = result.pop('cacheable', True)
+        if self.cache is None:
+            result['cache'] = 'off'
+            return result
+        if not cacheable:
+            # Not cached: OCR attempts failed or a page read no text at all
+            result['cache'] = 'skipped'
+            return result
+        
+        cached = dict(result)
+        if not self.config['cache']['store_text']:
+            cached.pop('raw_text', None)
+        self.cache.set(cache_key, cached)
+        result['cache'] = 'miss'
+        
+        return result
+
+def warm_up_page():
+    """A small synthetic marksheet page, used to warm up a new process"""
+    page = np.full((700, 1000, 3), 255, dtype=np.uint8)
+    lines = ['SAMPLE UNIVERSITY', 'SEMESTER GRADE REPORT', 'SPI 8.50', 'CPI 8.20']
+    for row, line in enumerate(lines):
+        cv2.putText(page, line, (80, 120 + 140 * row), cv2.FONT_HERSHEY_SIMPLEX, 1.4, (0, 0, 0), 3)
+    return page
+
+def preload():
+    """Import everything the pipeline may need later, including the lazy imports.
+    
+    Meant for servers that load the app once and then fork workers (gunicorn
+    --preload), so the modules are loaded once and shared copy-on-write. It
+    starts no threads, tesseract engines (the OCR backend is created on first
+    use, see get_ocr_backend) or OpenCV thread pools, which don't survive a
+    fork; warm_up does that, in each worker.
+    """
+    try:
+        load_pdf2image()
+    except RuntimeError:
+        pass
+
+def warm_up(pipeline=None):
+    """Run one synthetic page through `pipeline` and return the seconds it took.
+    
+    The first page of a process pays one-time costs (loading the tesseract
+    model and engines, starting the worker threads and OpenCV's thread pool);
+    warming up moves them out of the first request. The page bypasses the
+    result cache and the timing histograms. Failures are logged, not raised.
+    """
+    start = time.perf_counter()
+    try:
+        (pipeline or MarksheetPipeline()).extract_page(warm_up_page())
+    except Exception:
+        logger.warning('Warm-up failed', exc_info=True)
+    return time.perf_counter() - start
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Extract SPI/CPI or percentages from marksheet images and PDFs')
+    parser.add_argument('files', nargs='+', help='marksheet images (png/jpg) or PDFs')
+    parser.add_argument('--mode', choices=['parallel', 'cascade'], help='OCR mode (default: OCR_MODE)')
+    parser.add_argument('--no-roi', action='store_true', help='OCR whole pages instead of the result region')
+    parser.add_argument('--no-cache', action='store_true', help='bypass the result cache')
+    parser.add_argument('--dpi', type=int, help='PDF render resolution')
+    parser.add_argument('--max-pages', type=int, help='maximum PDF pages per document')
+    parser.add_argument('--raw-text', action='store_true', help='include the OCR text in the output')
+    parser.add_argument('--timings', action='store_true', help='print the time spent in each stage to stderr')
+    args = parser.parse_args(argv)
+    
+    config = {'cache': {'enabled': not args.no_cache}}
+    if args.mode:
+        config['ocr'] = {'mode': args.mode}
+    if args.no_roi:
+        config['locate'] = {'enabled': False}
+    pipeline = MarksheetPipeline(config)
+    
+    failed = 0
+    for path in args.files:
+        result = {}
+        try:
+            with open(path, 'rb') as f:
+                result = pipeline.run(f.read(), os.path.basename(path), args.dpi, args.max_pages)
+            output = to_api_result(result)
+            if args.raw_text:
+                output['raw_text'] = result.get('raw_text', '')
+        except Exception as e:
+            failed += 1
+            output = {'success': False, 'error': str(e)}
+        print(json.dumps({'file': path, **output}))
+        if args.timings and 'timings' in result:
+            timings = result['timings']
+            print(f'{path}: {timings["total_ms"]:.0f} ms (' +
+                  ', '.join(f'{stage} {ms:.0f} ms' for stage, ms in timings['stages_ms'].items()) + ')',
+                  file=sys.stderr)
+    
+    return 1 if failed else 0
+
+if __name__ == '__main__':
+    sys.exit(main())
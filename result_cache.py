@@ -0,0 +1,120 @@
+"""Content-addressed cache for marksheet extraction results.
+
+Results are keyed by a hash of the uploaded bytes plus a fingerprint of the
+pipeline configuration, so a re-upload of the same document skips
+preprocessing and OCR entirely. There are two tiers: a small in-memory LRU
+and a SQLite file on disk that survives restarts and is shared between worker
+processes. Both tiers expire entries after `ttl` seconds; the disk tier is also
+trimmed to `max_disk_entries`, dropping the least recently used rows first.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+class ResultCache:
+    def __init__(self, path, max_memory_entries=256, max_disk_entries=10000, ttl=7 * 24 * 3600):
+        self.path = path
+        self.max_memory_entries = max_memory_entries
+        self.max_disk_entries = max_disk_entries
+        self.ttl = ttl
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+
+        if self.path:
+            os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+            with self._connect() as conn:
+                conn.execute(
+                    'CREATE TABLE IF NOT EXISTS results ('
+                    'key TEXT PRIMARY KEY, value TEXT NOT NULL, '
+                    'created REAL NOT NULL, accessed REAL NOT NULL)'
+                )
+                conn.execute('CREATE INDEX IF NOT EXISTS results_accessed ON results (accessed)')
+
+    @staticmethod
+    def make_key(data, *parts):
+        """Hash the document bytes together with anything else the result depends on"""
+        digest = hashlib.sha256(data)
+        for part in parts:
+            digest.update(b'\0')
+            digest.update(str(part).encode('utf-8'))
+        return digest.hexdigest()
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=10)
+        try:
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        """Return the cached result for `key`, or None"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created, value = entry
+                if now - created <= self.ttl:
+                    self._memory.move_to_end(key)
+                    return json.loads(value)
+                del self._memory[key]
+
+        if not self.path:
+            return None
+
+        with self._connect() as conn:
+            row = conn.execute('SELECT value, created FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None:
+                return None
+            value, created = row
+            if now - created > self.ttl:
+                conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                return None
+            conn.execute('UPDATE results SET accessed = ? WHERE key = ?', (now, key))
+
+        self._remember(key, created, value)
+        return json.loads(value)
+
+    def set(self, key, result):
+        """Store a JSON-serializable result under `key` in both tiers"""
+        now = time.time()
+        value = json.dumps(result)
+        self._remember(key, now, value)
+
+        if not self.path:
+            return
+
+        with self._connect() as conn:
+            conn.execute(
+                'INSERT OR REPLACE INTO results (key, value, created, accessed) VALUES (?, ?, ?, ?)',
+                (key, value, now, now)
+            )
+            conn.execute('DELETE FROM results WHERE created < ?', (now - self.ttl,))
+            conn.execute(
+                'DELETE FROM results WHERE key IN ('
+                'SELECT key FROM results ORDER BY accessed DESC LIMIT -1 OFFSET ?)',
+                (self.max_disk_entries,)
+            )
+
+    def _remember(self, key, created, value):
+        with self._lock:
+            self._memory[key] = (created, value)
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def clear(self):
+        """Drop every cached result"""
+        with self._lock:
+            self._memory.clear()
+        if self.path:
+            with self._connect() as conn:
+                conn.execute('DELETE FROM results')